@@ -48,5 +48,5 @@ if os.environ.get('HEROKU') is not None:
 
 app.jinja_env.globals['momentjs'] = momentjs
 
-from app import views, models
+from app import views, models, api
 
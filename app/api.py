@@ -0,0 +1,209 @@
+from datetime import datetime
+from hashlib import sha1
+from flask import request, g, jsonify, abort, Response
+from flask.ext.login import login_required
+from app import app, db
+from hierarchy import resolve_path, scope_query, group_counts, NodeCounts
+from labels import filter_selector
+from models import Organization, Env, Group, Node, NodeLabel, BOOTSTRAP_NONE, BOOTSTRAP_STATUS_NAMES
+from config import API_PAGE_SIZE, MAX_API_PAGE_SIZE
+
+API = '/api/v1'
+
+# the fields of the nodes of the API and the columns they are read from. The
+# representations are tagged with the tree version of their organization, so
+# probed_at, written by every probe, is left out: a probe only changes the
+# version when reachable, fd_space or probe_error change
+NODE_COLUMNS = [
+    ('id', Node.id),
+    ('name', Node.name),
+    ('ip', Node.ip),
+    ('env', Env.name),
+    ('group', Group.name),
+    ('bootstrap', Node.bootstrap_status),
+    ('bootstrapped_at', Node.bootstrapped_at),
+    ('fingerprint', Node.fingerprint),
+    ('reachable', Node.reachable),
+    ('fd_space', Node.fd_space),
+    ('probe_error', Node.probe_error),
+    ('timestamp', Node.timestamp)
+]
+NODE_FIELDS = [name for name, column in NODE_COLUMNS] + ['labels']
+
+
+def json_value(name, value):
+    if name == 'bootstrap':
+        return BOOTSTRAP_STATUS_NAMES[value or BOOTSTRAP_NONE]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def parse_fields(text, fields):
+    """ Parse a sparse fieldset such as 'name,ip' into a list of the fields given, all of them by default. """
+    if not text:
+        return list(fields)
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise ValueError('unknown fields: %s' % ', '.join(unknown))
+    return [name for name in fields if name in names]
+
+
+def labels_of(node_ids):
+    """ Return a dict of node id to the dict of its labels, with one query. """
+    labels = dict((node_id, {}) for node_id in node_ids)
+    if node_ids:
+        for node_id, key, value in db.session.query(NodeLabel.node_id, NodeLabel.key, NodeLabel.value) \
+                .filter(NodeLabel.node_id.in_(node_ids)):
+            labels[node_id][key] = value
+    return labels
+
+
+def node_rows(org, env = None, grp = None, selector = None, fields = NODE_FIELDS, cursor = None, limit = API_PAGE_SIZE):
+    """
+    Return a page of the nodes of an organization, environment or group as
+    dicts of the fields asked for, in node id order, and the cursor of the
+    next page, None on the last page.
+
+    Only the columns of the fields asked for are read, with one query seeking
+    past the cursor node id, plus one query for the labels when asked for.
+    """
+    columns = [column for name, column in NODE_COLUMNS if name in fields]
+    query = filter_selector(scope_query([Group.id, Node.id] + columns, org, env, grp), selector)
+    if cursor is not None:
+        query = query.filter(Node.id > cursor)
+    rows = query.order_by(Node.id).limit(limit + 1).all()
+    next_cursor = rows[limit - 1][1] if len(rows) > limit else None
+    rows = rows[:limit]
+    names = [name for name, column in NODE_COLUMNS if name in fields]
+    nodes = [dict((name, json_value(name, value)) for name, value in zip(names, row[2:])) for row in rows]
+    if 'labels' in fields:
+        labels = labels_of([row[1] for row in rows])
+        for node, row in zip(nodes, rows):
+            node['labels'] = labels[row[1]]
+    return nodes, next_cursor
+
+
+def api_etag(version):
+    """ The ETag of the representation of the current URL for a version of the data behind it. """
+    return sha1('%s:%s:%s' % (g.user.id, version, request.url)).hexdigest()
+
+
+def etag_response(version, build):
+    """
+    Answer 304 Not Modified when the client already has the representation of
+    this version of the data, without building it. Otherwise return the JSON
+    of the dict build returns, tagged with its ETag.
+    """
+    etag = api_etag(version)
+    if request.if_none_match.contains(etag):
+        response = Response(status = 304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    return response
+
+
+def api_path(org_name, env_name = None, grp_name = None, node_name = None):
+    path = resolve_path(g.user, org_name, env_name, grp_name, node_name)
+    if path is None:
+        abort(404)
+    return path
+
+
+def api_page():
+    """ Return the cursor and the page size of a list request. """
+    return request.args.get('cursor', None, type = int), \
+        max(1, min(request.args.get('limit', API_PAGE_SIZE, type = int), MAX_API_PAGE_SIZE))
+
+
+def api_fields(fields):
+    try:
+        return parse_fields(request.args.get('fields'), fields)
+    except ValueError:
+        abort(400)
+
+
+def org_dict(org_id, name, timestamp, tree_version):
+    return {
+        'id': org_id,
+        'name': name,
+        'timestamp': json_value('timestamp', timestamp),
+        'version': tree_version or 0
+    }
+
+
+@app.route(API + '/orgs')
+@login_required
+def api_orgs():
+    cursor, limit = api_page()
+    query = db.session.query(Organization.id, Organization.name, Organization.timestamp, Organization.tree_version) \
+        .filter(Organization.user_id == g.user.id)
+    if cursor is not None:
+        query = query.filter(Organization.id > cursor)
+    orgs = query.order_by(Organization.id).limit(limit + 1).all()
+    def build():
+        return {
+            'orgs': [org_dict(*org) for org in orgs[:limit]],
+            'next_cursor': orgs[limit - 1][0] if len(orgs) > limit else None
+        }
+    # the versions of the organizations tell their renames and their content
+    return etag_response(','.join('%d.%d' % (org[0], org[3] or 0) for org in orgs), build)
+
+
+@app.route(API + '/orgs/<org_name>')
+@login_required
+def api_org(org_name):
+    org = api_path(org_name).org
+    def build():
+        counts = group_counts(org)
+        envs = []
+        for env in Env.query.filter(Env.org_id == org.id).order_by(Env.id):
+            envs.append({'id': env.id, 'name': env.name, 'groups': []})
+        env_groups = dict((env['id'], env['groups']) for env in envs)
+        for grp in Group.query.join(Env, Group.env_id == Env.id).filter(Env.org_id == org.id).order_by(Group.id):
+            total, bootstrapped = counts.get(grp.id, NodeCounts(0, 0))
+            env_groups[grp.env_id].append({'id': grp.id, 'name': grp.name, 'nodes': total, 'bootstrapped': bootstrapped})
+        result = org_dict(org.id, org.name, org.timestamp, org.tree_version)
+        result['envs'] = envs
+        return result
+    return etag_response(org.tree_version or 0, build)
+
+
+@app.route(API + '/orgs/<org_name>/nodes')
+@app.route(API + '/orgs/<org_name>/envs/<env_name>/nodes')
+@app.route(API + '/orgs/<org_name>/envs/<env_name>/groups/<grp_name>/nodes')
+@login_required
+def api_nodes(org_name, env_name = None, grp_name = None):
+    org, env, grp, node = api_path(org_name, env_name, grp_name)
+    cursor, limit = api_page()
+    fields = api_fields(NODE_FIELDS)
+    def build():
+        try:
+            nodes, next_cursor = node_rows(org, env, grp, request.args.get('selector'), fields, cursor, limit)
+        except ValueError:
+            abort(400)
+        return {
+            'nodes': nodes,
+            'next_cursor': next_cursor
+        }
+    return etag_response(org.tree_version or 0, build)
+
+
+@app.route(API + '/orgs/<org_name>/envs/<env_name>/groups/<grp_name>/nodes/<node_name>')
+@login_required
+def api_node(org_name, env_name, grp_name, node_name):
+    org, env, grp, node = api_path(org_name, env_name, grp_name, node_name)
+    fields = api_fields(NODE_FIELDS)
+    def build():
+        result = dict((name, json_value(name, getattr(node, column.key))) for name, column in NODE_COLUMNS
+            if name in fields and column.class_ is Node)
+        if 'env' in fields:
+            result['env'] = env.name
+        if 'group' in fields:
+            result['group'] = grp.name
+        if 'labels' in fields:
+            result['labels'] = labels_of([node.id])[node.id]
+        return result
+    return etag_response(org.tree_version or 0, build)
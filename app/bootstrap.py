@@ -0,0 +1,95 @@
+import os
+from datetime import datetime
+from app import app, db
+from decorators import async
+from executor import DeployExecutor
+from jobs import job_key, enqueue, on_finish, run_once
+from hierarchy import bump_tree_version
+from models import Env, Group, Node, BOOTSTRAP_DONE, BOOTSTRAP_FAILED
+from config import BOOTSTRAP_SCRIPT, BOOTSTRAP_CONCURRENCY, CAPTURE_DIR
+
+
+def bootstrap_command(ip, grp_name):
+    return BOOTSTRAP_SCRIPT + " " + ip + " " + grp_name
+
+
+def bootstrap_key(ip, grp_name):
+    return job_key('bootstrap', ip, grp_name)
+
+
+def pending_bootstrap(org, env = None, grp = None):
+    """
+    Return the (node_name, grp_name) pairs of the nodes of an organization,
+    environment or group that are not bootstrapped yet, with a single query.
+    """
+    query = db.session.query(Node.name, Group.name) \
+        .join(Group, Node.grp_id == Group.id) \
+        .join(Env, Group.env_id == Env.id) \
+        .filter(Env.org_id == org.id) \
+        .filter(db.or_(Node.bootstrap_status == None, Node.bootstrap_status != BOOTSTRAP_DONE))
+    if env is not None:
+        query = query.filter(Env.id == env.id)
+    if grp is not None:
+        query = query.filter(Group.id == grp.id)
+    return [(node_name, grp_name) for node_name, grp_name in query.order_by(Env.id, Group.id, Node.id)]
+
+
+@on_finish
+def record_bootstrap(job, key):
+    """ Record the outcome of a bootstrap job on its node, whichever worker ran it. """
+    if not key or not key.startswith('bootstrap:'):
+        return
+    # group names have no colon, IPv6 addresses do
+    ip = key[len('bootstrap:'):].rsplit(':', 1)[0]
+    values = {'bootstrap_job_id': job.id}
+    if job.exit_code == 0:
+        values['bootstrap_status'] = BOOTSTRAP_DONE
+        values['bootstrapped_at'] = job.finished
+    else:
+        values['bootstrap_status'] = BOOTSTRAP_FAILED
+    Node.query.filter_by(ip = ip).update(values, synchronize_session = False)
+    bump_tree_version(db.session.query(Env.org_id) \
+        .join(Group, Group.env_id == Env.id) \
+        .join(Node, Node.grp_id == Group.id) \
+        .filter(Node.ip == ip).scalar())
+
+
+def start_bootstrap(node, grp_name, user = None):
+    """
+    Queue the bootstrap of a node and return its Job right away, or the
+    bootstrap of the node already queued or running. The job is recorded on
+    the node at once, its outcome when it finishes.
+    """
+    job = enqueue(bootstrap_command(node.ip, grp_name), user = user, key = bootstrap_key(node.ip, grp_name), grp_name = grp_name)
+    Node.query.filter_by(id = node.id).update({'bootstrap_job_id': job.id}, synchronize_session = False)
+    db.session.commit()
+    return job
+
+
+def bootstrap_node(node_name, grp_name, log_path):
+    """
+    Bootstrap a node, or wait for the bootstrap already running, and return:
+    (status, output, error). The outcome is recorded on the node when the
+    bootstrap job finishes.
+    """
+    ip = db.session.query(Node.ip).filter_by(name = node_name).scalar()
+    job = run_once(bootstrap_command(ip, grp_name), bootstrap_key(ip, grp_name), log_path, grp_name)
+    return job.exit_code, job.output, job.error
+
+
+def bootstrap_in_thread(node_name, grp_name, log_path):
+    """ bootstrap_node for the worker threads of a DeployExecutor, which end their session when done. """
+    try:
+        return bootstrap_node(node_name, grp_name, log_path)
+    finally:
+        db.session.remove()
+
+
+@async
+def bootstrap_nodes(targets):
+    """ Bootstrap (node_name, grp_name) pairs in the background, BOOTSTRAP_CONCURRENCY at a time. """
+    log_dir = os.path.join(CAPTURE_DIR, datetime.utcnow().strftime('bootstrap-%Y%m%d%H%M%S%f'))
+    try:
+        DeployExecutor(BOOTSTRAP_CONCURRENCY, deploy = bootstrap_in_thread, log_dir = log_dir).run(targets)
+    except:
+        app.logger.exception('bootstrap failure')
@@ -0,0 +1,109 @@
+import gzip
+import os
+import time
+import zlib
+from collections import deque
+from itertools import islice
+from config import CAPTURE_HEAD_LINES, CAPTURE_TAIL_LINES, CAPTURE_MAX_LINE, CAPTURE_FLUSH_INTERVAL
+
+CHUNK_SIZE = 64 * 1024
+
+
+class OutputCapture(object):
+    """
+    Command output handler with bounded memory use.
+
+    The first and last lines of the output are kept in memory for a quick
+    summary, the complete output is spooled to a gzip file that a LogReader
+    can page through, even while it is still being written.
+    """
+
+    def __init__(self, path, head_lines=CAPTURE_HEAD_LINES, tail_lines=CAPTURE_TAIL_LINES):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.head_lines = head_lines
+        self.head = []
+        self.tail = deque(maxlen=tail_lines)
+        self.lines = 0
+        self.file = gzip.open(path, 'wb')
+        self.flushed = time.time()
+
+    def __call__(self, line):
+        self.lines += 1
+        self.file.write(line)
+        if len(line) > CAPTURE_MAX_LINE:
+            line = line[:CAPTURE_MAX_LINE] + '...\n'
+        if len(self.head) < self.head_lines:
+            self.head.append(line)
+        else:
+            self.tail.append(line)
+        if time.time() - self.flushed >= CAPTURE_FLUSH_INTERVAL:
+            # a sync flush makes everything written so far readable
+            self.file.flush()
+            self.flushed = time.time()
+
+    def close(self):
+        self.file.close()
+
+    def summary(self):
+        """ Return the head and tail of the output, noting how many lines were left out. """
+        skipped = self.lines - len(self.head) - len(self.tail)
+        text = ''.join(self.head)
+        if skipped > 0:
+            text += '\n... %d lines skipped ...\n\n' % skipped
+        return text + ''.join(self.tail)
+
+
+def run_captured(command, log_path, timeout=None):
+    """ Run a shell Command spooling its output to a log, then return: (status, output summary, error). """
+    capture = OutputCapture(log_path)
+    try:
+        status, output, error = command.run(timeout=timeout, output_handler=capture, shell=True)
+    finally:
+        capture.close()
+    return status, capture.summary(), error
+
+
+class LogReader(object):
+    """ Reads the lines of a log spooled by OutputCapture without loading it whole. """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def lines(self, follow=None, poll_interval=1):
+        """
+        Yield the lines of the log.
+
+        With a follow function the log is tailed while it is written, and
+        reading stops once follow() returns True and the log is exhausted.
+        """
+        while not os.path.exists(self.path):
+            if follow is None or follow():
+                return
+            time.sleep(poll_interval)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        partial = ''
+        with open(self.path, 'rb') as log:
+            while True:
+                # check first so nothing written before the end is missed
+                done = follow is None or follow()
+                for chunk in iter(lambda: log.read(CHUNK_SIZE), ''):
+                    lines = (partial + decompressor.decompress(chunk)).split('\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        yield line + '\n'
+                if done:
+                    break
+                time.sleep(poll_interval)
+        if partial:
+            yield partial
+
+    def page(self, page, per_page):
+        """ Return the lines of a 1 based page and whether there are more pages. """
+        lines = list(islice(self.lines(), (page - 1) * per_page, page * per_page + 1))
+        return lines[:per_page], len(lines) > per_page
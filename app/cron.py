@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+# (name, lowest, highest) of the fields of a cron expression
+FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 6)
+]
+
+# a schedule that does not match within this many years never will
+MAX_YEARS = 5
+
+
+def parse_field(text, name, low, high):
+    """ Parse a field such as '*', '*/15', '1-5' or '0,30' into the set of values it matches. """
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError('invalid step in the %s field' % name)
+        if part == '*':
+            first, last = low, high
+        elif '-' in part:
+            first, last = [int(value) for value in part.split('-', 1)]
+        else:
+            first = last = int(part)
+        if name == 'weekday' and last == 7:
+            # 7 is Sunday too
+            values.add(0)
+            if first == 7:
+                continue
+            last = 6
+        if first < low or last > high or first > last:
+            raise ValueError('%s out of range in the %s field' % (part, name))
+        values.update(range(first, last + 1, step))
+    return values
+
+
+class CronSchedule(object):
+    """
+    A recurring schedule in the classic five fields cron syntax:
+    minute hour day month weekday, with Sunday as weekday 0.
+
+    As in cron, when both the day and the weekday are restricted a time
+    matching either of them matches.
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != len(FIELDS):
+            raise ValueError('a cron expression has %d fields' % len(FIELDS))
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [parse_field(text, name, low, high)
+            for text, (name, low, high) in zip(fields, FIELDS)]
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def day_matches(self, when):
+        day = when.day in self.days
+        # isoweekday is 1 for Monday to 7 for Sunday
+        weekday = when.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, after):
+        """ Return the first time matching the schedule strictly after a datetime. """
+        when = after.replace(second = 0, microsecond = 0) + timedelta(minutes = 1)
+        while when.year <= after.year + MAX_YEARS:
+            if when.month not in self.months:
+                when = datetime(when.year + when.month // 12, when.month % 12 + 1, 1)
+            elif not self.day_matches(when):
+                when = datetime(when.year, when.month, when.day) + timedelta(days = 1)
+            elif when.hour not in self.hours:
+                when = datetime(when.year, when.month, when.day, when.hour) + timedelta(hours = 1)
+            elif when.minute not in self.minutes:
+                when += timedelta(minutes = 1)
+            else:
+                return when
+        raise ValueError('the schedule never matches')
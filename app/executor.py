@@ -0,0 +1,201 @@
+import os
+import heapq
+import threading
+import time
+import traceback
+from collections import namedtuple
+from datetime import datetime
+from run import Command
+from capture import run_captured
+from strategies import DeployStrategy, RetryPolicy
+from models import NameValidator
+from config import DEPLOY_SCRIPT, DEPLOY_CONCURRENCY, CAPTURE_DIR
+
+
+class NodeResult(namedtuple('NodeResult', 'node_name grp_name status output error log started finished attempts')):
+    """ Outcome of deploying a single node, after `attempts` tries. """
+
+    @property
+    def ok(self):
+        return self.status == 0
+
+    @property
+    def skipped(self):
+        return self.status is None
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return None
+        return (self.finished - self.started).total_seconds()
+
+
+HALTED = 'Skipped, the rollout was halted.'
+
+
+def skipped_result(node_name, grp_name, error=HALTED):
+    return NodeResult(node_name, grp_name, None, '', error, None, None, None, 0)
+
+
+def deploy_command(node_name, grp_name):
+    return DEPLOY_SCRIPT + " " + node_name + " " + grp_name
+
+
+def summarize(results):
+    """ Count the NodeResults that succeeded, failed, were skipped and needed retries. """
+    return {
+        'succeeded': len([result for result in results if result.ok]),
+        'failed': len([result for result in results if not result.ok and not result.skipped]),
+        'skipped': len([result for result in results if result.skipped]),
+        'retried': len([result for result in results if result.attempts > 1])
+    }
+
+
+def node_log_name(node_name, grp_name):
+    return NameValidator.make_valid_name(grp_name) + '.' + NameValidator.make_valid_name(node_name) + '.log.gz'
+
+
+def deploy_node(node_name, grp_name, log_path):
+    """ Deploy a single node then return: (status, output, error), with only the head and tail of the output. """
+    return run_captured(Command(deploy_command(node_name, grp_name)), log_path)
+
+
+class DeployExecutor(object):
+    """
+    Deploys many nodes at once with a bounded pool of worker threads.
+
+    The wall clock time of a run grows with the number of batches of
+    `concurrency` nodes instead of with the number of nodes. The limit is
+    shared by all the groups an executor deploys at the same time.
+
+    When a RunProgress is given it is told about every node started, retried
+    and finished.
+    """
+
+    def __init__(self, concurrency=DEPLOY_CONCURRENCY, deploy=deploy_node, log_dir=CAPTURE_DIR, retry=None, progress=None):
+        self.concurrency = max(1, concurrency)
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        self.deploy = deploy
+        self.log_dir = log_dir
+        self.retry = retry or RetryPolicy()
+        self.progress = progress
+
+    def skip(self, targets, error=HALTED):
+        results = [skipped_result(node_name, grp_name, error) for node_name, grp_name in targets]
+        if self.progress is not None:
+            for result in results:
+                self.progress.node_finished(result)
+        return results
+
+    def run(self, targets, strategy=None):
+        """
+        Deploy a list of (node_name, grp_name) pairs then return one NodeResult per pair, in order.
+
+        The batches of the strategy are deployed one after the other, the nodes
+        of the batches left when the rollout halts are returned as skipped.
+        """
+        targets = list(targets)
+        strategy = strategy or DeployStrategy()
+        results = []
+        failures = 0
+        for batch in strategy.batches(targets):
+            if strategy.halted(failures):
+                results.extend(self.skip(batch))
+                continue
+            batch_results = self.run_batch(batch)
+            failures += len([result for result in batch_results if not result.ok])
+            results.extend(batch_results)
+        return results
+
+    def run_batch(self, targets):
+        """
+        Deploy a list of (node_name, grp_name) pairs all at once.
+
+        Failed nodes are put back in the queue until their backoff is over, the
+        worker threads deploy the other nodes in the meantime.
+        """
+        results = [None] * len(targets)
+        attempts = [0] * len(targets)
+        # (time the node is due, index of the node) pairs
+        due = [(0, i) for i in range(len(targets))]
+        running = [0]
+        ready = threading.Condition()
+
+        def next_target():
+            with ready:
+                while True:
+                    if not due and not running[0]:
+                        return None
+                    now = time.time()
+                    if due and due[0][0] <= now:
+                        running[0] += 1
+                        return heapq.heappop(due)[1]
+                    ready.wait(due[0][0] - now if due else None)
+
+        def worker():
+            while True:
+                i = next_target()
+                if i is None:
+                    return
+                node_name, grp_name = targets[i]
+                log = os.path.join(self.log_dir, node_log_name(node_name, grp_name))
+                with self.slots:
+                    if self.progress is not None:
+                        self.progress.node_started()
+                    started = datetime.utcnow()
+                    try:
+                        status, output, error = self.deploy(node_name, grp_name, log)
+                    except:
+                        status, output, error = -1, '', traceback.format_exc()
+                with ready:
+                    attempts[i] += 1
+                    retry = status != 0 and self.retry.should_retry(attempts[i])
+                    if retry:
+                        heapq.heappush(due, (time.time() + self.retry.backoff(attempts[i]), i))
+                    else:
+                        results[i] = NodeResult(node_name, grp_name, status, output, error, log, started, datetime.utcnow(), attempts[i])
+                    running[0] -= 1
+                    ready.notify_all()
+                if self.progress is not None and retry:
+                    self.progress.node_retrying()
+                elif self.progress is not None:
+                    self.progress.node_finished(results[i])
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.concurrency, len(targets)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def run_stages(self, stages, strategy=None):
+        """
+        Deploy stages of groups one after the other, the groups of a stage in parallel.
+
+        A stage is a list of groups, each a list of (node_name, grp_name) pairs
+        rolled out with the strategy. When a stage has more failures than the
+        strategy allows the following stages are skipped.
+        """
+        strategy = strategy or DeployStrategy()
+        results = []
+        halted = False
+        for stage in stages:
+            if halted:
+                results.extend(self.skip([target for targets in stage for target in targets]))
+                continue
+            stage_results = [[] for targets in stage]
+            def deploy_group(i, targets):
+                stage_results[i] = self.run(targets, strategy)
+            threads = [threading.Thread(target=deploy_group, args=(i, targets)) for i, targets in enumerate(stage)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for group_results in stage_results:
+                results.extend(group_results)
+            halted = strategy.halted(len([result for group_results in stage_results for result in group_results if not result.ok]))
+        return results
+
+    def run_group(self, grp, strategy=None):
+        """ Deploy every node of a Group. """
+        return self.run([(node.name, grp.name) for node in grp.nodes.all()], strategy)
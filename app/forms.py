@@ -1,9 +1,13 @@
+from datetime import datetime
 from flask.ext.wtf import Form
-from wtforms import TextField, BooleanField, TextAreaField
-from wtforms.validators import Required, Length
+from wtforms import TextField, BooleanField, TextAreaField, SelectField, IntegerField, DateTimeField
+from wtforms.validators import Required, Length, Optional
 
 from flask.ext.babel import gettext
-from app.models import User, MCSetting, Organization, Env, Group, Node
+from app.models import User, MCSetting, Organization, Env, Group, Node, CATCH_UP_NAMES
+from app.cron import CronSchedule
+from app.labels import parse_labels
+from app.hierarchy import cached_tree
 
 class LoginForm(Form):
     openid = TextField('openid', validators = [Required()])
@@ -96,7 +100,7 @@ class EnvEditForm(Form):
     def __init__(self, org, original_name, *args, **kwargs):
         Form.__init__(self, *args, **kwargs)
         self.original_name = original_name
-        self.org_name = org.name
+        self.org = org
 
     def validate(self):
         if not Form.validate(self):
@@ -106,11 +110,10 @@ class EnvEditForm(Form):
         if self.name.data != Env.make_valid_name(self.name.data):
             self.name.errors.append(gettext('This name has invalid characters. Please use letters, numbers, dots and underscores only.'))
             return False
-        org = Organization.query.filter_by(name = self.org_name).first()
-        if org == None:
+        if self.org == None:
             self.name.errors.append(gettext('The organization name was not found'))
             return False
-        env = org.envs.filter_by(name = self.name.data).first()
+        env = self.org.envs.filter_by(name = self.name.data).first()
         if env != None:
             self.name.errors.append(gettext('The environment name already exists'))
             return False
@@ -122,8 +125,7 @@ class GrpEditForm(Form):
     def __init__(self, org, env, original_name, *args, **kwargs):
         Form.__init__(self, *args, **kwargs)
         self.original_name = original_name
-        self.org_name = org.name
-        self.env_name = env.name
+        self.env = env
 
     def validate(self):
         if not Form.validate(self):
@@ -133,15 +135,10 @@ class GrpEditForm(Form):
         if self.name.data != Group.make_valid_name(self.name.data):
             self.name.errors.append(gettext('This name has invalid characters. Please use letters, numbers, dots and underscores only.'))
             return False
-        org = Organization.query.filter_by(name = self.org_name).first()
-        if org == None:
-            self.name.errors.append(gettext('The organization name was not found'))
-            return False
-        env = org.envs.filter_by(name = self.env_name).first()
-        if env == None:
+        if self.env == None:
             self.name.errors.append(gettext('The environment name was not found'))
             return False
-        grp = env.groups.filter_by(name = self.name.data).first()
+        grp = self.env.groups.filter_by(name = self.name.data).first()
         if grp != None:
             self.name.errors.append(gettext('The group name already exists'))
             return False
@@ -150,36 +147,66 @@ class GrpEditForm(Form):
 class NodeEditForm(Form):
     name = TextField('name', validators = [Required()])
     ip = TextField('ip', validators = [Required()])
+    labels = TextField('labels', validators = [Optional()])
 
     def __init__(self, org, env, grp, original_name, *args, **kwargs):
         Form.__init__(self, *args, **kwargs)
         self.original_name = original_name
-        self.org_name = org.name
-        self.env_name = env.name
-        self.grp_name = grp.name
+        self.grp = grp
+        self.label_values = {}
 
     def validate(self):
         if not Form.validate(self):
             return False
+        try:
+            self.label_values = parse_labels(self.labels.data)
+        except ValueError as e:
+            self.labels.errors.append(gettext('Invalid labels: %(error)s', error = e))
+            return False
         if self.name.data == self.original_name:
             return True
         if self.name.data != Node.make_valid_name(self.name.data):
             self.name.errors.append(gettext('This name has invalid characters. Please use letters, numbers, dots and underscores only.'))
             return False
-        org = Organization.query.filter_by(name = self.org_name).first()
-        if org == None:
-            self.name.errors.append(gettext('The organization name was not found'))
-            return False
-        env = org.envs.filter_by(name = self.env_name).first()
-        if env == None:
-            self.name.errors.append(gettext('The environment name was not found'))
-            return False
-        grp = env.groups.filter_by(name = self.grp_name).first()
-        if grp == None:
+        if self.grp == None:
             self.name.errors.append(gettext('The group name was not found'))
             return False
-        node = grp.nodes.filter_by(name = self.name.data).first()
+        node = self.grp.nodes.filter_by(name = self.name.data).first()
         if node != None:
             self.name.errors.append(gettext('The node name already exists'))
             return False
         return True
+
+class ScheduleForm(Form):
+    scope = SelectField('scope')
+    cron = TextField('cron', validators = [Optional(), Length(max = 140)])
+    run_at = DateTimeField('run_at', format = '%Y-%m-%d %H:%M', validators = [Optional()])
+    catch_up = SelectField('catch_up', coerce = int, choices = sorted(CATCH_UP_NAMES.items()))
+    strategy = SelectField('strategy', choices = [('all', 'All at once'), ('canary', 'Canaries first'),
+        ('rolling', 'Rolling batches'), ('percent', 'Percentage batches')])
+    size = IntegerField('size', validators = [Optional()])
+    max_failures = IntegerField('max_failures', default = 0, validators = [Optional()])
+    order = TextField('order', validators = [Optional(), Length(max = 255)])
+    version = TextField('version', validators = [Optional(), Length(max = 140)])
+    force = BooleanField('force', default = False)
+
+    def __init__(self, org, *args, **kwargs):
+        Form.__init__(self, *args, **kwargs)
+        self.scope.choices = []
+        for env, groups in cached_tree(org):
+            self.scope.choices.append(('env:%d' % env.id, env.name))
+            self.scope.choices.extend(('grp:%d' % grp.id, env.name + ' / ' + grp.name) for grp, nodes, counts in groups)
+
+    def validate(self):
+        if not Form.validate(self):
+            return False
+        if bool(self.cron.data) == bool(self.run_at.data):
+            self.cron.errors.append(gettext('Give either a cron schedule or a time.'))
+            return False
+        if self.cron.data:
+            try:
+                CronSchedule(self.cron.data).next_after(datetime.utcnow())
+            except ValueError as e:
+                self.cron.errors.append(gettext('Invalid cron schedule: %(error)s', error = str(e)))
+                return False
+        return True
@@ -0,0 +1,217 @@
+import threading
+from collections import OrderedDict, namedtuple
+from app import db
+from models import Organization, Env, Group, Node, BOOTSTRAP_DONE
+from labels import filter_selector
+from config import NODES_PER_PAGE, LOOKUP_BATCH_SIZE
+
+# an environment with its groups, and a group with the first page of its
+# nodes and its node counts
+EnvTree = namedtuple('EnvTree', 'env groups')
+GroupTree = namedtuple('GroupTree', 'grp nodes counts')
+NodeCounts = namedtuple('NodeCounts', 'total bootstrapped')
+
+# the entities named by a URL, None past the last name
+Path = namedtuple('Path', 'org env grp node')
+
+_trees_lock = threading.Lock()
+_trees = {}
+
+
+def cached_tree(org):
+    """
+    Return the tree of an organization like load_tree, from the cache of this
+    process while the tree_version of the organization did not change.
+
+    The cached entities are detached from their session, only their columns
+    can be read.
+    """
+    version = org.tree_version or 0
+    with _trees_lock:
+        cached = _trees.get(org.id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    tree = load_tree(org)
+    for env, groups in tree:
+        db.session.expunge(env)
+        for grp, nodes, counts in groups:
+            db.session.expunge(grp)
+            for node in nodes:
+                db.session.expunge(node)
+    with _trees_lock:
+        _trees[org.id] = (version, tree)
+    return tree
+
+
+def bump_tree_version(org_id):
+    """ Make the cached trees of an organization stale in every process, when the current transaction commits. """
+    Organization.query.filter_by(id = org_id).update({'tree_version': db.func.coalesce(Organization.tree_version, 0) + 1}, synchronize_session = False)
+
+
+def bump_node_orgs(node_ids):
+    """
+    Bump the tree version of the organizations of nodes given by id, when the
+    current transaction commits. The organizations are found LOOKUP_BATCH_SIZE
+    nodes per query.
+    """
+    node_ids = sorted(set(node_ids))
+    org_ids = set()
+    for start in range(0, len(node_ids), LOOKUP_BATCH_SIZE):
+        org_ids.update(org_id for org_id, in db.session.query(Env.org_id).distinct() \
+            .join(Group, Group.env_id == Env.id) \
+            .join(Node, Node.grp_id == Group.id) \
+            .filter(Node.id.in_(node_ids[start:start + LOOKUP_BATCH_SIZE])))
+    for org_id in sorted(org_ids):
+        bump_tree_version(org_id)
+
+
+def resolve_path(user, org_name, env_name = None, grp_name = None, node_name = None):
+    """
+    Resolve an organization of a user and the environment, group and node
+    named under it with a single joined query. Return a Path, or None when
+    one of the names is not found.
+    """
+    entities = [Organization]
+    query = db.session.query(Organization).filter(Organization.user_id == user.id, Organization.name == org_name)
+    if env_name is not None:
+        entities.append(Env)
+        query = query.add_entity(Env).join(Env, Env.org_id == Organization.id).filter(Env.name == env_name)
+        if grp_name is not None:
+            entities.append(Group)
+            query = query.add_entity(Group).join(Group, Group.env_id == Env.id).filter(Group.name == grp_name)
+            if node_name is not None:
+                entities.append(Node)
+                query = query.add_entity(Node).join(Node, Node.grp_id == Group.id).filter(Node.name == node_name)
+    row = query.first()
+    if row is None:
+        return None
+    if len(entities) == 1:
+        row = (row,)
+    return Path(*(tuple(row) + (None,) * (4 - len(entities))))
+
+
+def scope_query(columns, org, env = None, grp = None):
+    """ Query columns of the nodes of an organization, environment or group, joined with their groups and environments. """
+    query = db.session.query(*columns) \
+        .join(Env, Group.env_id == Env.id) \
+        .join(Node, Node.grp_id == Group.id) \
+        .filter(Env.org_id == org.id)
+    if env is not None:
+        query = query.filter(Env.id == env.id)
+    if grp is not None:
+        query = query.filter(Group.id == grp.id)
+    return query
+
+
+def group_counts(org, env = None, grp = None):
+    """
+    Count the nodes of each group of an organization, environment or group,
+    and how many are bootstrapped, with one aggregate query. Return a dict of
+    group id to NodeCounts, without the groups that have no nodes.
+    """
+    bootstrapped = db.func.sum(db.case([(Node.bootstrap_status == BOOTSTRAP_DONE, 1)], else_ = 0))
+    query = scope_query([Group.id, db.func.count(Node.id), bootstrapped], org, env, grp).group_by(Group.id)
+    return dict((grp_id, NodeCounts(total, int(done or 0))) for grp_id, total, done in query)
+
+
+def first_nodes(org, size = NODES_PER_PAGE):
+    """
+    Load the first nodes by name of each group of an organization with one
+    query, at most size per group however large the groups are.
+    """
+    other = Node.__table__.alias()
+    # the name of the last node of the first page of the group, NULL when the whole group fits in a page
+    last = db.select([other.c.name], other.c.grp_id == Node.grp_id) \
+        .order_by(other.c.name).limit(1).offset(size - 1).as_scalar()
+    return Node.query.join(Group, Node.grp_id == Group.id) \
+        .join(Env, Group.env_id == Env.id) \
+        .filter(Env.org_id == org.id) \
+        .filter(Node.name <= db.func.coalesce(last, Node.name)) \
+        .order_by(Node.grp_id, Node.name).all()
+
+
+def node_page(grp, after = None, size = NODES_PER_PAGE, selector = None):
+    """
+    Return up to size nodes of a group by name, following the name after when
+    given, and the name to continue after, None on the last page.
+
+    The page starts with a seek on the (grp_id, name) index rather than an
+    OFFSET, so the last page of a large group costs as little as the first.
+    """
+    query = filter_selector(Node.query.filter(Node.grp_id == grp.id), selector)
+    if after:
+        query = query.filter(Node.name > after)
+    nodes = query.order_by(Node.name).limit(size + 1).all()
+    return nodes[:size], (nodes[size - 1].name if len(nodes) > size else None)
+
+
+def load_tree(org):
+    """
+    Load the environments and groups of an organization, with the first
+    NODES_PER_PAGE nodes and the node counts of each group, with four queries
+    however many there are, and return a list of EnvTree.
+    """
+    envs = Env.query.filter(Env.org_id == org.id).order_by(Env.id).all()
+    groups = Group.query.join(Env, Group.env_id == Env.id) \
+        .filter(Env.org_id == org.id).order_by(Group.id).all()
+    counts = group_counts(org)
+    grp_nodes = dict((grp.id, []) for grp in groups)
+    for node in first_nodes(org):
+        grp_nodes[node.grp_id].append(node)
+    env_groups = dict((env.id, []) for env in envs)
+    for grp in groups:
+        env_groups[grp.env_id].append(GroupTree(grp, grp_nodes[grp.id], counts.get(grp.id, NodeCounts(0, 0))))
+    return [EnvTree(env, env_groups[env.id]) for env in envs]
+
+
+def is_unchanged(grp_name, node_name, ip, fingerprint, version):
+    """ Whether a node was already deployed with a version, unchanged since. Without a version no node is. """
+    return bool(version) and fingerprint == Node.make_fingerprint(grp_name, node_name, ip, version)
+
+
+def group_targets(org, env = None, grp = None, version = None, selector = None):
+    """
+    Resolve the nodes of an organization, environment or group with a single
+    query and return an OrderedDict of group name to (node_name, grp_name) pairs
+    and the number of nodes left out.
+
+    When a version is given the nodes whose fingerprint shows that they were
+    already deployed with it, unchanged, are left out. When a label selector is
+    given only the nodes it matches are resolved, within the same query.
+    """
+    query = filter_selector(scope_query([Group.name, Node.name, Node.ip, Node.fingerprint], org, env, grp), selector)
+    groups = OrderedDict()
+    unchanged = 0
+    for grp_name, node_name, ip, fingerprint in query.order_by(Env.id, Group.id, Node.id):
+        if is_unchanged(grp_name, node_name, ip, fingerprint, version):
+            unchanged += 1
+        else:
+            groups.setdefault(grp_name, []).append((node_name, grp_name))
+    return groups, unchanged
+
+
+def parse_order(order):
+    """ Parse a group ordering such as 'db > cache, queue > app' into a list of sets of group names. """
+    stages = []
+    for stage in (order or '').split('>'):
+        names = set(name.strip() for name in stage.split(',') if name.strip())
+        if names:
+            stages.append(names)
+    return stages
+
+
+def make_stages(groups, order = None):
+    """
+    Split the groups returned by group_targets in stages following the order.
+
+    Groups not named in the order are deployed in a last stage.
+    """
+    stages = []
+    left = OrderedDict(groups)
+    for names in parse_order(order):
+        stage = [left.pop(name) for name in list(left) if name in names]
+        if stage:
+            stages.append(stage)
+    if left:
+        stages.append(left.values())
+    return stages
@@ -0,0 +1,100 @@
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import db
+from executor import summarize, HALTED
+from hierarchy import bump_node_orgs
+from models import DeployRun, NodeDeployResult, Env, Group, Node, RUN_RUNNING, RUN_SUCCEEDED, RUN_FAILED, RUN_HALTED
+from config import LOOKUP_BATCH_SIZE
+
+
+def start_run(org = None, env = None, grp = None, user = None, strategy = None, key = None, version = None, selector = None):
+    """
+    Record the start of a deploy run and return (run, True), unless a run with
+    the same key is still running, then return (that run, False).
+    """
+    while True:
+        run = DeployRun(org = org,
+            env = env,
+            grp = grp,
+            user = user,
+            strategy = strategy,
+            version = version,
+            selector = selector,
+            inflight_key = key,
+            status = RUN_RUNNING,
+            started_at = datetime.utcnow())
+        db.session.add(run)
+        try:
+            db.session.commit()
+            return run, True
+        except IntegrityError:
+            db.session.rollback()
+            active = DeployRun.query.filter_by(inflight_key = key).first()
+            if active is not None:
+                return active, False
+
+
+def run_nodes(run, node_names):
+    """
+    Return a dict of (grp_name, node_name) to (node id, group id, ip) for the
+    named nodes within the organization, environment or group of a deploy
+    run, LOOKUP_BATCH_SIZE names per query.
+    """
+    query = db.session.query(Group.name, Node.name, Node.id, Group.id, Node.ip).join(Node, Node.grp_id == Group.id)
+    if run.grp_id is not None:
+        query = query.filter(Group.id == run.grp_id)
+    elif run.env_id is not None:
+        query = query.filter(Group.env_id == run.env_id)
+    elif run.org_id is not None:
+        query = query.join(Env, Group.env_id == Env.id).filter(Env.org_id == run.org_id)
+    node_names = sorted(set(node_names))
+    nodes = {}
+    for start in range(0, len(node_names), LOOKUP_BATCH_SIZE):
+        for grp_name, node_name, node_id, grp_id, ip in query.filter(Node.name.in_(node_names[start:start + LOOKUP_BATCH_SIZE])):
+            nodes[(grp_name, node_name)] = (node_id, grp_id, ip)
+    return nodes
+
+
+def finish_run(run, results):
+    """
+    Record the NodeResults of a deploy run and their counts, with a single
+    commit. The nodes deployed successfully get the fingerprint of the
+    version of the run, and the version of their organization changes.
+    """
+    nodes = run_nodes(run, [result.node_name for result in results])
+    if run.version is not None:
+        deployed = [(result, nodes[(result.grp_name, result.node_name)]) for result in results
+            if result.ok and (result.grp_name, result.node_name) in nodes]
+        if deployed:
+            node = Node.__table__
+            db.session.execute(node.update().where(node.c.id == db.bindparam('b_id')).values(fingerprint = db.bindparam('b_fingerprint')),
+                [{'b_id': node_id, 'b_fingerprint': Node.make_fingerprint(result.grp_name, result.node_name, ip, run.version)}
+                    for result, (node_id, grp_id, ip) in deployed])
+        bump_node_orgs([node_id for result, (node_id, grp_id, ip) in deployed])
+    found = [nodes.get((result.grp_name, result.node_name), (None, None, None)) for result in results]
+    db.session.add_all([NodeDeployResult(run = run,
+        node_id = node_id,
+        grp_id = grp_id,
+        started_at = result.started,
+        finished_at = result.finished,
+        duration = result.duration,
+        exit_status = result.status,
+        attempts = result.attempts,
+        output = result.output,
+        error = result.error,
+        log = result.log) for result, (node_id, grp_id, ip) in zip(results, found)])
+    for name, count in summarize(results).items():
+        setattr(run, name, count)
+    run.inflight_key = None
+    run.finished_at = datetime.utcnow()
+    run.duration = (run.finished_at - run.started_at).total_seconds()
+    # nodes left out by the probe triage do not halt the run
+    if [result for result in results if result.skipped and result.error == HALTED]:
+        run.status = RUN_HALTED
+    elif [result for result in results if not result.ok and not result.skipped]:
+        run.status = RUN_FAILED
+    else:
+        run.status = RUN_SUCCEEDED
+    db.session.add(run)
+    db.session.commit()
+    return run
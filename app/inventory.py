@@ -0,0 +1,181 @@
+import csv
+import json
+from itertools import chain
+from StringIO import StringIO
+from datetime import datetime
+from app import db
+from models import Env, Group, Node, BOOTSTRAP_NONE, BOOTSTRAP_STATUS_NAMES
+from hierarchy import bump_tree_version, scope_query
+from labels import parse_labels, format_labels, set_labels
+from config import IMPORT_BATCH_SIZE, EXPORT_WINDOW
+
+NODE_FIELDS = ('name', 'ip', 'group')
+EXPORT_FIELDS = ('env', 'group', 'name', 'ip', 'bootstrap', 'fingerprint')
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'chef': 'application/json'
+}
+
+
+def parse_nodes(data, format = 'csv'):
+    """
+    Parse nodes given as CSV with a name,ip,group header line, or as a JSON
+    list of objects with these keys, into a list of dicts of unicode strings.
+    Nodes can also have labels, as 'role=web,dc=east' or as a JSON object.
+    """
+    if format == 'json':
+        rows = json.loads(data)
+        if not isinstance(rows, list) or [row for row in rows if not isinstance(row, dict)]:
+            raise ValueError('a JSON import is a list of objects')
+        for row in rows:
+            if isinstance(row.get('labels'), dict):
+                row['labels'] = format_labels(row['labels'])
+    else:
+        rows = [dict((key, value.decode('utf-8') if isinstance(value, str) else value) for key, value in row.items())
+            for row in csv.DictReader(StringIO(data))]
+    return [dict((key, unicode(row.get(key) or '').strip()) for key in NODE_FIELDS + ('labels',)) for row in rows]
+
+
+def row_error(row, taken_names, taken_ips):
+    """ Return why a parsed row cannot be imported, or None. """
+    for key in NODE_FIELDS:
+        if not row[key]:
+            return 'The %s is missing' % key
+    if row['name'] != Node.make_valid_name(row['name']):
+        return 'The node name %s has invalid characters' % row['name']
+    if row['group'] != Group.make_valid_name(row['group']):
+        return 'The group name %s has invalid characters' % row['group']
+    try:
+        parse_labels(row.get('labels'))
+    except ValueError as e:
+        return 'The labels are invalid: %s' % e
+    if row['name'] in taken_names:
+        return 'The node name %s already exists' % row['name']
+    if row['ip'] in taken_ips:
+        return 'The ip %s already exists' % row['ip']
+    return None
+
+
+def import_nodes(org, env, rows):
+    """
+    Add parsed nodes to the groups of an environment, creating the groups
+    that do not exist yet, and return the number of nodes added and a list of
+    (row number, error) for the rows left out.
+
+    The rows are imported in batches of IMPORT_BATCH_SIZE: the names and ips
+    already taken are found with one query per batch, and the nodes of a batch
+    are inserted with a single statement and committed together.
+    """
+    errors = []
+    imported = 0
+    grp_names = set(row['group'] for row in rows if row['group'])
+    groups = dict((grp.name, grp) for grp in Group.query.filter(Group.name.in_(grp_names))) if grp_names else {}
+    seen_names = set()
+    seen_ips = set()
+    for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+        batch = list(enumerate(rows[start:start + IMPORT_BATCH_SIZE], start + 1))
+        names = [row['name'] for number, row in batch if row['name']]
+        ips = [row['ip'] for number, row in batch if row['ip']]
+        conditions = []
+        if names:
+            conditions.append(Node.name.in_(names))
+        if ips:
+            conditions.append(Node.ip.in_(ips))
+        taken = db.session.query(Node.name, Node.ip).filter(db.or_(*conditions)).all() if conditions else []
+        taken_names = seen_names | set(name for name, ip in taken)
+        taken_ips = seen_ips | set(ip for name, ip in taken)
+        now = datetime.utcnow()
+        values = []
+        labels = {}
+        for number, row in batch:
+            error = row_error(row, taken_names, taken_ips)
+            grp = groups.get(row['group'])
+            if error is None and grp is not None and grp.env_id != env.id:
+                error = 'The group %s belongs to another environment' % row['group']
+            if error is not None:
+                errors.append((number, error))
+                continue
+            if grp is None:
+                grp = Group(name = row['group'], env = env, timestamp = now)
+                db.session.add(grp)
+                db.session.flush()
+                groups[grp.name] = grp
+            taken_names.add(row['name'])
+            taken_ips.add(row['ip'])
+            seen_names.add(row['name'])
+            seen_ips.add(row['ip'])
+            values.append({'name': row['name'], 'ip': row['ip'], 'grp_id': grp.id, 'timestamp': now})
+            if row.get('labels'):
+                labels[row['name']] = parse_labels(row['labels'])
+        if values:
+            db.session.execute(Node.__table__.insert(), values)
+        if labels:
+            node_ids = db.session.query(Node.name, Node.id).filter(Node.name.in_(labels.keys()))
+            set_labels(dict((node_id, labels[node_name]) for node_name, node_id in node_ids))
+        if values:
+            bump_tree_version(org.id)
+        db.session.commit()
+        imported += len(values)
+    return imported, errors
+
+
+def export_nodes(org, env = None, grp = None, window = EXPORT_WINDOW):
+    """
+    Yield a dict of EXPORT_FIELDS for each node of an organization, environment
+    or group, in node id order.
+
+    The nodes are fetched a window at a time, each window starting after the
+    last node id of the previous one, so memory use does not grow with the
+    fleet and no window has to skip over the rows already exported.
+    """
+    columns = [Group.name, Env.name, Node.id, Node.name, Node.ip, Node.bootstrap_status, Node.fingerprint]
+    last = 0
+    while True:
+        rows = scope_query(columns, org, env, grp).filter(Node.id > last).order_by(Node.id).limit(window).all()
+        for grp_name, env_name, node_id, node_name, ip, bootstrap_status, fingerprint in rows:
+            yield {
+                'env': env_name,
+                'group': grp_name,
+                'name': node_name,
+                'ip': ip,
+                'bootstrap': BOOTSTRAP_STATUS_NAMES[bootstrap_status or BOOTSTRAP_NONE],
+                'fingerprint': fingerprint
+            }
+        if len(rows) < window:
+            return
+        last = rows[-1].id
+
+
+def chef_node(node):
+    """ A node as the JSON object knife node from file reads, with its group as its role. """
+    return {
+        'name': node['name'],
+        'chef_environment': node['env'],
+        'json_class': 'Chef::Node',
+        'chef_type': 'node',
+        'automatic': {'ipaddress': node['ip']},
+        'run_list': ['role[%s]' % node['group']]
+    }
+
+
+def export_lines(nodes, format = 'csv'):
+    """ Yield exported nodes as the lines of a CSV file, of a JSON Lines file or of a JSON list of chef nodes. """
+    if format == 'csv':
+        line = StringIO()
+        writer = csv.writer(line)
+        rows = ([(node[key] or '').encode('utf-8') for key in EXPORT_FIELDS] for node in nodes)
+        for row in chain([EXPORT_FIELDS], rows):
+            writer.writerow(row)
+            yield line.getvalue()
+            line.seek(0)
+            line.truncate()
+    elif format == 'jsonl':
+        for node in nodes:
+            yield json.dumps(node) + '\n'
+    else:
+        separator = '[\n'
+        for node in nodes:
+            yield separator + json.dumps(chef_node(node))
+            separator = ',\n'
+        yield '[]\n' if separator == '[\n' else '\n]\n'
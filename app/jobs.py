@@ -0,0 +1,245 @@
+import os
+import shutil
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import Job, JOB_QUEUED, JOB_RUNNING, JOB_FINISHED
+from run import Command
+from capture import LogReader, run_captured
+from limits import deploy_slots
+from config import JOB_WORKERS, JOB_POLL_INTERVAL, JOB_STALE_TIMEOUT
+
+_workers_lock = threading.Lock()
+_workers_pid = None
+_finish_hooks = []
+
+
+def worker_name():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def job_key(action, *names):
+    return ':'.join((action,) + names)
+
+
+def active_job(key):
+    return Job.query.filter_by(inflight_key = key).first()
+
+
+def insert_job(job):
+    """
+    Store a new job and return (job, True), unless a job with the same
+    inflight_key is already queued or running, then return (that job, False).
+    """
+    while True:
+        db.session.add(job)
+        try:
+            db.session.commit()
+            return job, True
+        except IntegrityError:
+            db.session.rollback()
+            active = active_job(job.inflight_key)
+            if active is not None:
+                return active, False
+            # the other job finished in the meantime, try again
+
+
+def enqueue(command, user = None, timeout = None, key = None, grp_name = None):
+    """
+    Queue a shell command and return its Job right away. When a job with the
+    same key is already queued or running that job is returned instead, so
+    duplicate requests all get the result of a single run.
+    """
+    job, created = insert_job(Job(command = command,
+        timeout = timeout,
+        status = JOB_QUEUED,
+        inflight_key = key,
+        grp_name = grp_name,
+        user = user,
+        timestamp = datetime.utcnow()))
+    start_workers()
+    return job
+
+
+def start_job(command, key, log = None, grp_name = None):
+    """ Like insert_job, for a job run right away by the caller instead of by the workers. """
+    now = datetime.utcnow()
+    return insert_job(Job(command = command,
+        status = JOB_RUNNING,
+        inflight_key = key,
+        grp_name = grp_name,
+        log = log,
+        worker = worker_name(),
+        timestamp = now,
+        started = now,
+        heartbeat = now))
+
+
+def on_finish(hook):
+    """
+    Register a function called with every job that finishes and the key it
+    ran under, in the transaction that records the outcome of the job.
+    """
+    _finish_hooks.append(hook)
+    return hook
+
+
+def finish_job(job, status, output, error, usage = None):
+    key = job.inflight_key
+    job.exit_code = status
+    job.output = output
+    job.error = error
+    if usage is not None:
+        job.wall_time, job.cpu_time, job.max_rss = usage
+    job.status = JOB_FINISHED
+    job.inflight_key = None
+    job.finished = datetime.utcnow()
+    db.session.add(job)
+    for hook in _finish_hooks:
+        hook(job, key)
+    db.session.commit()
+
+
+def wait_job(job):
+    """ Wait until a job finishes, then return it refreshed. """
+    job_id = job.id
+    while True:
+        # the commit ends the transaction and expires the loaded jobs
+        db.session.commit()
+        job = Job.query.get(job_id)
+        if job.is_finished():
+            return job
+        time.sleep(JOB_POLL_INTERVAL)
+
+
+def claim():
+    """ Take the oldest queued job for this worker, or return None. """
+    while True:
+        job = Job.query.filter_by(status = JOB_QUEUED).order_by(Job.id).first()
+        if job is None:
+            return None
+        now = datetime.utcnow()
+        # the status check in the update makes the claim atomic across workers
+        claimed = Job.query.filter_by(id = job.id, status = JOB_QUEUED).update({
+            'status': JOB_RUNNING,
+            'worker': worker_name(),
+            'started': now,
+            'heartbeat': now }, synchronize_session = False)
+        db.session.commit()
+        if claimed:
+            db.session.expire(job)
+            return job
+
+
+def requeue_stale():
+    """ Put back in the queue the running jobs of workers that died. """
+    limit = datetime.utcnow() - timedelta(seconds = JOB_STALE_TIMEOUT)
+    Job.query.filter(Job.status == JOB_RUNNING, Job.heartbeat < limit).update({
+        'status': JOB_QUEUED,
+        'worker': None }, synchronize_session = False)
+    db.session.commit()
+
+
+def heartbeat(job_id, done):
+    try:
+        while not done.wait(JOB_STALE_TIMEOUT / 4.0):
+            Job.query.filter_by(id = job_id).update({'heartbeat': datetime.utcnow()}, synchronize_session = False)
+            db.session.commit()
+    finally:
+        db.session.remove()
+
+
+def start_heartbeat(job):
+    """ Keep a running job alive until the returned event is set. """
+    done = threading.Event()
+    beat = threading.Thread(target = heartbeat, args = (job.id, done))
+    beat.daemon = True
+    beat.start()
+    return done
+
+
+def run_job(job):
+    done = start_heartbeat(job)
+    command = Command(job.command)
+    try:
+        with deploy_slots(job.id, job.grp_name):
+            status, output, error = run_captured(command, job.log_path(), job.timeout)
+    except:
+        status, output, error = -1, '', traceback.format_exc()
+    finally:
+        done.set()
+    finish_job(job, status, output, error, command.usage)
+
+
+def run_once(command, key, log_path, grp_name = None):
+    """
+    Run a shell command as a job right away, holding the deploy slots of its
+    group, unless a job with the same key is already queued or running in any
+    worker process. Then wait for that job instead, copying its log, so both
+    callers get the result of a single run. Return the finished job.
+    """
+    job, created = start_job(command, key, log = log_path, grp_name = grp_name)
+    if not created:
+        job = wait_job(job)
+        if os.path.exists(job.log_path()) and job.log_path() != log_path:
+            if not os.path.exists(os.path.dirname(log_path)):
+                os.makedirs(os.path.dirname(log_path))
+            shutil.copyfile(job.log_path(), log_path)
+        return job
+    done = start_heartbeat(job)
+    command = Command(command)
+    try:
+        with deploy_slots(job.id, grp_name):
+            result = run_captured(command, log_path)
+    except:
+        result = -1, '', traceback.format_exc()
+    done.set()
+    finish_job(job, *result, usage = command.usage)
+    return job
+
+
+def follow_log(job):
+    """ Yield the output lines of a job as they are written, until it finishes. """
+    job_id = job.id
+    def finished():
+        db.session.commit()
+        status = db.session.query(Job.status).filter_by(id = job_id).scalar()
+        return status is None or status == JOB_FINISHED
+    try:
+        for line in LogReader(job.log_path()).lines(follow = finished, poll_interval = JOB_POLL_INTERVAL):
+            yield line
+    finally:
+        db.session.remove()
+
+
+def work():
+    while True:
+        try:
+            job = claim()
+            if job is None:
+                requeue_stale()
+                time.sleep(JOB_POLL_INTERVAL)
+            else:
+                run_job(job)
+        except:
+            app.logger.exception('job worker failure')
+            time.sleep(JOB_POLL_INTERVAL)
+        finally:
+            db.session.remove()
+
+
+def start_workers():
+    """ Start the job worker threads of this process, once per process. """
+    global _workers_pid
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers_pid = os.getpid()
+        for i in range(JOB_WORKERS):
+            thread = threading.Thread(target = work, name = 'job-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
@@ -0,0 +1,129 @@
+import re
+from collections import namedtuple, OrderedDict
+from app import db
+from models import Node, NodeLabel
+
+LABEL_KEY = r'[A-Za-z0-9_./-]+'
+LABEL_VALUE = r'[A-Za-z0-9_.-]*'
+
+Requirement = namedtuple('Requirement', 'key op values')
+
+REQUIREMENT = re.compile(r'''\s*(?:
+    !\s*(?P<absent>%(key)s) |
+    (?P<key>%(key)s)\s*(?:
+        (?P<op>==|=|!=)\s*(?P<value>%(value)s) |
+        \s(?P<set>in|notin)\s*\((?P<values>[^)]*)\)
+    )?
+)\s*(?:,|$)''' % {'key': LABEL_KEY, 'value': LABEL_VALUE}, re.VERBOSE)
+
+LABEL = re.compile(r'\s*(%s)\s*=\s*(%s)\s*$' % (LABEL_KEY, LABEL_VALUE))
+
+
+def parse_selector(text):
+    """
+    Parse a label selector such as 'role=web,dc!=east' into a list of
+    Requirement. A node matches when it matches every requirement of the list:
+      key=value, key==value   the node has the label with this value
+      key!=value              the node does not have the label with this value
+      key in (a, b)           the node has the label with one of the values
+      key notin (a, b)        the node does not have the label with any of the values
+      key                     the node has the label
+      !key                    the node does not have the label
+    """
+    text = (text or '').strip()
+    requirements = []
+    pos = 0
+    while pos < len(text):
+        match = REQUIREMENT.match(text, pos)
+        if match is None or match.end() == pos:
+            raise ValueError('invalid selector at "%s"' % text[pos:])
+        pos = match.end()
+        if match.group('absent'):
+            requirements.append(Requirement(match.group('absent'), 'notexists', ()))
+        elif match.group('op'):
+            requirements.append(Requirement(match.group('key'), 'notin' if match.group('op') == '!=' else 'in',
+                (match.group('value'),)))
+        elif match.group('set'):
+            values = tuple(value.strip() for value in match.group('values').split(','))
+            for value in values:
+                if not re.match(LABEL_VALUE + '$', value):
+                    raise ValueError('invalid label value "%s"' % value)
+            requirements.append(Requirement(match.group('key'), match.group('set'), values))
+        else:
+            requirements.append(Requirement(match.group('key'), 'exists', ()))
+    return requirements
+
+
+def format_selector(requirements):
+    """ The canonical text of parsed requirements, in the order given. """
+    parts = []
+    for key, op, values in requirements:
+        if op == 'notexists':
+            parts.append('!' + key)
+        elif op == 'exists':
+            parts.append(key)
+        elif len(values) == 1:
+            parts.append('%s%s%s' % (key, '=' if op == 'in' else '!=', values[0]))
+        else:
+            parts.append('%s %s (%s)' % (key, op, ','.join(values)))
+    return ','.join(parts)
+
+
+def selector_filter(requirements):
+    """
+    Compile parsed requirements to a condition on Node, made of one EXISTS or
+    NOT EXISTS subquery on the node_label table per requirement, so a query of
+    nodes is filtered in the database however many nodes and labels there are.
+    """
+    conditions = []
+    for key, op, values in requirements:
+        label = [NodeLabel.node_id == Node.id, NodeLabel.key == key]
+        if values:
+            label.append(NodeLabel.value.in_(values))
+        exists = db.exists().where(db.and_(*label))
+        conditions.append(~exists if op in ('notin', 'notexists') else exists)
+    return db.and_(*conditions)
+
+
+def filter_selector(query, selector):
+    """ Filter a query of nodes with the text of a selector, when it has requirements. """
+    requirements = parse_selector(selector)
+    if requirements:
+        query = query.filter(selector_filter(requirements))
+    return query
+
+
+def parse_labels(text):
+    """ Parse labels such as 'role=web, dc=east' into an OrderedDict of key to value. """
+    labels = OrderedDict()
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        match = LABEL.match(part)
+        if match is None:
+            raise ValueError('invalid label "%s"' % part.strip())
+        key, value = match.groups()
+        if len(key) > 64 or len(value) > 140:
+            raise ValueError('label "%s" is too long' % key)
+        labels[key] = value
+    return labels
+
+
+def format_labels(labels):
+    return ','.join('%s=%s' % (key, value) for key, value in labels.items())
+
+
+def node_labels(node):
+    """ The labels of a node as an OrderedDict sorted by key. """
+    return OrderedDict((label.key, label.value) for label in node.labels.order_by(NodeLabel.key))
+
+
+def set_labels(labels):
+    """ Replace the labels of nodes, given as a dict of node id to a dict of key to value, without committing. """
+    if not labels:
+        return
+    NodeLabel.query.filter(NodeLabel.node_id.in_(labels.keys())).delete(synchronize_session = False)
+    values = [{'node_id': node_id, 'key': key, 'value': value}
+        for node_id, node_labels in labels.items() for key, value in node_labels.items()]
+    if values:
+        db.session.execute(NodeLabel.__table__.insert(), values)
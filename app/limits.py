@@ -0,0 +1,89 @@
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import DeploySlot, Job, JOB_QUEUED, JOB_FINISHED
+from config import DEPLOY_GLOBAL_LIMIT, DEPLOY_GROUP_LIMIT, DEPLOY_GROUP_LIMITS, JOB_POLL_INTERVAL, JOB_STALE_TIMEOUT
+
+GLOBAL_SCOPE = 'global'
+
+
+def group_scope(grp_name):
+    return 'grp:' + grp_name
+
+
+def scope_limits(grp_name = None):
+    """ Return the (scope, limit) pairs a chef run of a group has to respect, in acquisition order. """
+    scopes = []
+    if grp_name:
+        scopes.append((group_scope(grp_name), DEPLOY_GROUP_LIMITS.get(grp_name, DEPLOY_GROUP_LIMIT)))
+    scopes.append((GLOBAL_SCOPE, DEPLOY_GLOBAL_LIMIT))
+    return scopes
+
+
+def release_stale():
+    """ Drop the slots held or waited for by jobs that finished or whose worker died. """
+    limit = datetime.utcnow() - timedelta(seconds = JOB_STALE_TIMEOUT)
+    dead = db.session.query(Job.id).filter(db.or_(Job.status == JOB_FINISHED, Job.heartbeat < limit))
+    DeploySlot.query.filter(DeploySlot.job_id.in_(dead.subquery())).delete(synchronize_session = False)
+    db.session.commit()
+
+
+def acquire(scope, limit, job_id):
+    """
+    Wait for a free slot of a scope and return the id of the DeploySlot held.
+
+    Slot numbers are unique per scope in the database, so the limit holds
+    across all the worker processes. Waiters get the slots in arrival order.
+    """
+    waiter = DeploySlot(scope = scope, job_id = job_id, timestamp = datetime.utcnow())
+    db.session.add(waiter)
+    db.session.commit()
+    slot_id = waiter.id
+    while True:
+        ahead = DeploySlot.query.filter(DeploySlot.scope == scope, DeploySlot.slot == None, DeploySlot.id < slot_id).count()
+        taken = set(slot for slot, in db.session.query(DeploySlot.slot).filter(DeploySlot.scope == scope, DeploySlot.slot != None))
+        free = [i for i in range(limit) if i not in taken]
+        if ahead < len(free):
+            for i in free:
+                try:
+                    DeploySlot.query.filter_by(id = slot_id).update({'slot': i}, synchronize_session = False)
+                    db.session.commit()
+                    return slot_id
+                except IntegrityError:
+                    db.session.rollback()
+        time.sleep(JOB_POLL_INTERVAL)
+        release_stale()
+
+
+def release(slot_ids):
+    if slot_ids:
+        DeploySlot.query.filter(DeploySlot.id.in_(slot_ids)).delete(synchronize_session = False)
+        db.session.commit()
+
+
+@contextmanager
+def deploy_slots(job_id, grp_name = None):
+    """ Hold a slot of the group and a global slot while a chef run of the job goes on. """
+    slot_ids = []
+    try:
+        for scope, limit in scope_limits(grp_name):
+            slot_ids.append(acquire(scope, limit, job_id))
+        yield
+    finally:
+        db.session.rollback()
+        release(slot_ids)
+
+
+def queue_depth():
+    """ Return the number of queued jobs and, per scope, the number of running and waiting chef runs. """
+    running = dict(db.session.query(DeploySlot.scope, db.func.count(DeploySlot.id)) \
+        .filter(DeploySlot.slot != None).group_by(DeploySlot.scope))
+    waiting = dict(db.session.query(DeploySlot.scope, db.func.count(DeploySlot.id)) \
+        .filter(DeploySlot.slot == None).group_by(DeploySlot.scope))
+    return {
+        'queued': Job.query.filter_by(status = JOB_QUEUED).count(),
+        'running': running,
+        'waiting': waiting
+    }
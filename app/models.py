@@ -1,12 +1,50 @@
-from hashlib import md5
+from hashlib import md5, sha1
 from app import db
 from app import app
-from config import WHOOSH_ENABLED
+from config import WHOOSH_ENABLED, JOB_LOG_DIR, CAPTURE_DIR
+import os
 import re
 
 ROLE_USER = 0
 ROLE_ADMIN = 1
 
+JOB_QUEUED = 0
+JOB_RUNNING = 1
+JOB_FINISHED = 2
+JOB_STATUS_NAMES = {
+    JOB_QUEUED: 'queued',
+    JOB_RUNNING: 'running',
+    JOB_FINISHED: 'finished'
+}
+
+RUN_RUNNING = 0
+RUN_SUCCEEDED = 1
+RUN_FAILED = 2
+RUN_HALTED = 3
+RUN_STATUS_NAMES = {
+    RUN_RUNNING: 'running',
+    RUN_SUCCEEDED: 'succeeded',
+    RUN_FAILED: 'failed',
+    RUN_HALTED: 'halted'
+}
+
+BOOTSTRAP_NONE = 0
+BOOTSTRAP_DONE = 1
+BOOTSTRAP_FAILED = 2
+BOOTSTRAP_STATUS_NAMES = {
+    BOOTSTRAP_NONE: 'not bootstrapped',
+    BOOTSTRAP_DONE: 'bootstrapped',
+    BOOTSTRAP_FAILED: 'bootstrap failed'
+}
+
+# what a scheduler that was down does with the deploys it missed
+CATCH_UP_SKIP = 0
+CATCH_UP_ONCE = 1
+CATCH_UP_NAMES = {
+    CATCH_UP_SKIP: 'skip missed deploys',
+    CATCH_UP_ONCE: 'deploy once when missed'
+}
+
 followers = db.Table('followers',
     db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
     db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
@@ -26,6 +64,9 @@ class User(db.Model):
     posts = db.relationship('Post', backref = 'author', lazy = 'dynamic')
     settings = db.relationship('MCSetting', backref = 'author', lazy = 'dynamic')
     organizations = db.relationship('Organization', backref = 'user', lazy = 'dynamic')
+    jobs = db.relationship('Job', backref = 'user', lazy = 'dynamic')
+    runs = db.relationship('DeployRun', backref = 'user', lazy = 'dynamic')
+    schedules = db.relationship('DeploySchedule', backref = 'user', lazy = 'dynamic')
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime)
     followed = db.relationship('User', 
@@ -103,13 +144,26 @@ class Organization(db.Model):
     id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String(140), unique = True)
     timestamp = db.Column(db.DateTime)
+    tree_version = db.Column(db.Integer, default = 0)
     envs = db.relationship('Env', backref = 'org', lazy = 'dynamic')
+    runs = db.relationship('DeployRun', backref = 'org', lazy = 'dynamic')
+    schedules = db.relationship('DeploySchedule', backref = 'org', lazy = 'dynamic')
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     
     @staticmethod
     def make_valid_name(nickname):
         return NameValidator.make_valid_name(nickname)
 
+    def last_node_results(self):
+        """ Query the last deploy result of every node of the organization. """
+        last = db.session.query(NodeDeployResult.node_id, db.func.max(NodeDeployResult.started_at).label('started_at')) \
+            .join(Node, NodeDeployResult.node_id == Node.id) \
+            .join(Group, Node.grp_id == Group.id) \
+            .join(Env, Group.env_id == Env.id) \
+            .filter(Env.org_id == self.id) \
+            .group_by(NodeDeployResult.node_id).subquery()
+        return NodeDeployResult.query.join(last, db.and_(NodeDeployResult.node_id == last.c.node_id, NodeDeployResult.started_at == last.c.started_at))
+
     def __repr__(self): # pragma: no cover
         return '<Organization %r>' % (self.name)
 
@@ -120,6 +174,8 @@ class Env(db.Model):
     name = db.Column(db.String(140), unique = True)
     timestamp = db.Column(db.DateTime)
     groups = db.relationship('Group', backref = 'env', lazy = 'dynamic')
+    runs = db.relationship('DeployRun', backref = 'env', lazy = 'dynamic')
+    schedules = db.relationship('DeploySchedule', backref = 'env', lazy = 'dynamic')
     org_id = db.Column(db.Integer, db.ForeignKey('organization.id'))
 
     @staticmethod
@@ -136,6 +192,8 @@ class Group(db.Model):
     name = db.Column(db.String(140), unique = True)
     timestamp = db.Column(db.DateTime)
     nodes = db.relationship('Node', backref = 'grp', lazy = 'dynamic')
+    runs = db.relationship('DeployRun', backref = 'grp', lazy = 'dynamic')
+    schedules = db.relationship('DeploySchedule', backref = 'grp', lazy = 'dynamic')
     env_id = db.Column(db.Integer, db.ForeignKey('env.id'))
 
     @staticmethod
@@ -153,16 +211,229 @@ class Node(db.Model):
     fd_space = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime)
     ip = db.Column(db.String(45), unique = True)
+    fingerprint = db.Column(db.String(40))
+    bootstrap_status = db.Column(db.SmallInteger, default = BOOTSTRAP_NONE)
+    bootstrapped_at = db.Column(db.DateTime)
+    bootstrap_job_id = db.Column(db.Integer, db.ForeignKey('job.id'))
+    reachable = db.Column(db.Boolean)
+    probed_at = db.Column(db.DateTime, index = True)
+    probe_error = db.Column(db.String(255))
     grp_id = db.Column(db.Integer, db.ForeignKey('group.id'))
+    results = db.relationship('NodeDeployResult', backref = 'node', lazy = 'dynamic')
+    labels = db.relationship('NodeLabel', backref = 'node', lazy = 'dynamic')
+    bootstrap_job = db.relationship('Job')
 
     @staticmethod
     def make_valid_name(nickname):
         return NameValidator.make_valid_name(nickname)
 
+    @staticmethod
+    def make_fingerprint(grp_name, name, ip, version):
+        """ Hash of the desired state of a node, stored after a successful deploy. """
+        return sha1('\0'.join([grp_name, name, ip or '', version or '']).encode('utf-8')).hexdigest()
+
+    def is_bootstrapped(self):
+        return self.bootstrap_status == BOOTSTRAP_DONE
+
+    def bootstrap_status_name(self):
+        return BOOTSTRAP_STATUS_NAMES[self.bootstrap_status or BOOTSTRAP_NONE]
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'ip': self.ip,
+            'bootstrap': self.bootstrap_status_name(),
+            'bootstrapped_at': self.bootstrapped_at.isoformat() if self.bootstrapped_at else None,
+            'bootstrap_job_id': self.bootstrap_job_id,
+            'fingerprint': self.fingerprint,
+            'reachable': self.reachable,
+            'fd_space': self.fd_space,
+            'probed_at': self.probed_at.isoformat() if self.probed_at else None,
+            'probe_error': self.probe_error
+        }
+
     def __repr__(self): # pragma: no cover
         return '<Node %r>' % (self.name)
+
+class NodeLabel(db.Model):
+    node_id = db.Column(db.Integer, db.ForeignKey('node.id'), primary_key = True)
+    key = db.Column(db.String(64), primary_key = True)
+    value = db.Column(db.String(140))
+
+    def __repr__(self): # pragma: no cover
+        return '<NodeLabel %r=%r>' % (self.key, self.value)
+
+db.Index('ix_node_label_key_value', NodeLabel.key, NodeLabel.value)
 	
 
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    command = db.Column(db.String(1024))
+    timeout = db.Column(db.Integer)
+    status = db.Column(db.SmallInteger, index = True, default = JOB_QUEUED)
+    exit_code = db.Column(db.Integer)
+    output = db.Column(db.Text)
+    error = db.Column(db.Text)
+    log = db.Column(db.String(255))
+    wall_time = db.Column(db.Float)
+    cpu_time = db.Column(db.Float)
+    max_rss = db.Column(db.Integer)
+    inflight_key = db.Column(db.String(255), index = True, unique = True)
+    grp_name = db.Column(db.String(140))
+    worker = db.Column(db.String(140))
+    timestamp = db.Column(db.DateTime)
+    started = db.Column(db.DateTime)
+    heartbeat = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    def status_name(self):
+        return JOB_STATUS_NAMES[self.status]
+
+    def is_finished(self):
+        return self.status == JOB_FINISHED
+
+    def log_path(self):
+        return self.log or os.path.join(JOB_LOG_DIR, '%d.log.gz' % self.id)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status_name(),
+            'exit_code': self.exit_code,
+            'output': self.output,
+            'error': self.error,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'max_rss': self.max_rss
+        }
+
+    def __repr__(self): # pragma: no cover
+        return '<Job %r>' % (self.id)
+
+class DeploySlot(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    scope = db.Column(db.String(140))
+    slot = db.Column(db.Integer)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), index = True)
+    timestamp = db.Column(db.DateTime)
+
+    def __repr__(self): # pragma: no cover
+        return '<DeploySlot %r %r>' % (self.scope, self.slot)
+
+db.Index('ix_organization_user_name', Organization.user_id, Organization.name)
+db.Index('ix_env_org_name', Env.org_id, Env.name)
+db.Index('ix_group_env_name', Group.env_id, Group.name)
+db.Index('ix_node_grp_name', Node.grp_id, Node.name)
+
+db.Index('ix_deploy_slot_scope_slot', DeploySlot.scope, DeploySlot.slot, unique = True)
+
+class DeployRun(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    strategy = db.Column(db.String(140))
+    version = db.Column(db.String(140))
+    selector = db.Column(db.String(255))
+    unchanged = db.Column(db.Integer, default = 0)
+    succeeded = db.Column(db.Integer, default = 0)
+    failed = db.Column(db.Integer, default = 0)
+    skipped = db.Column(db.Integer, default = 0)
+    retried = db.Column(db.Integer, default = 0)
+    progress = db.Column(db.Text)
+    status = db.Column(db.SmallInteger, default = RUN_RUNNING)
+    inflight_key = db.Column(db.String(255), index = True, unique = True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)
+    org_id = db.Column(db.Integer, db.ForeignKey('organization.id'))
+    env_id = db.Column(db.Integer, db.ForeignKey('env.id'))
+    grp_id = db.Column(db.Integer, db.ForeignKey('group.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    results = db.relationship('NodeDeployResult', backref = 'run', lazy = 'dynamic')
+
+    def status_name(self):
+        return RUN_STATUS_NAMES[self.status]
+
+    def is_running(self):
+        return self.status == RUN_RUNNING
+
+    def scope_name(self):
+        if self.grp is not None:
+            return self.grp.name
+        if self.env is not None:
+            return self.env.name
+        return self.org.name
+
+    def log_dir(self):
+        return os.path.join(CAPTURE_DIR, 'run-%d' % self.id)
+
+    def __repr__(self): # pragma: no cover
+        return '<DeployRun %r>' % (self.id)
+
+db.Index('ix_deploy_run_grp_started', DeployRun.grp_id, DeployRun.started_at)
+
+class NodeDeployResult(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    run_id = db.Column(db.Integer, db.ForeignKey('deploy_run.id'), index = True)
+    node_id = db.Column(db.Integer, db.ForeignKey('node.id'))
+    grp_id = db.Column(db.Integer, db.ForeignKey('group.id'))
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)
+    exit_status = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, default = 1)
+    output = db.Column(db.Text)
+    error = db.Column(db.Text)
+    log = db.Column(db.String(255))
+
+    def is_ok(self):
+        return self.exit_status == 0
+
+    def is_skipped(self):
+        return self.exit_status is None
+
+    def __repr__(self): # pragma: no cover
+        return '<NodeDeployResult %r>' % (self.id)
+
+db.Index('ix_node_deploy_result_node_started', NodeDeployResult.node_id, NodeDeployResult.started_at)
+db.Index('ix_node_deploy_result_grp_started', NodeDeployResult.grp_id, NodeDeployResult.started_at)
+
+class DeploySchedule(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    cron = db.Column(db.String(140))
+    run_at = db.Column(db.DateTime)
+    catch_up = db.Column(db.SmallInteger, default = CATCH_UP_SKIP)
+    enabled = db.Column(db.Boolean, default = True)
+    strategy = db.Column(db.String(140))
+    size = db.Column(db.Integer)
+    max_failures = db.Column(db.Integer, default = 0)
+    order = db.Column(db.String(255))
+    version = db.Column(db.String(140))
+    force = db.Column(db.Boolean, default = False)
+    last_run_at = db.Column(db.DateTime)
+    last_run_id = db.Column(db.Integer, db.ForeignKey('deploy_run.id'))
+    timestamp = db.Column(db.DateTime)
+    org_id = db.Column(db.Integer, db.ForeignKey('organization.id'))
+    env_id = db.Column(db.Integer, db.ForeignKey('env.id'))
+    grp_id = db.Column(db.Integer, db.ForeignKey('group.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    last_run = db.relationship('DeployRun')
+
+    def is_recurring(self):
+        return bool(self.cron)
+
+    def catch_up_name(self):
+        return CATCH_UP_NAMES[self.catch_up]
+
+    def scope_name(self):
+        if self.grp is not None:
+            return self.grp.name
+        return self.env.name
+
+    def __repr__(self): # pragma: no cover
+        return '<DeploySchedule %r>' % (self.id)
+
+db.Index('ix_deploy_schedule_enabled_run_at', DeploySchedule.enabled, DeploySchedule.run_at)
+
 class MCSetting(db.Model):
     id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String(255))
@@ -0,0 +1,104 @@
+import heapq
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app import db
+from hierarchy import scope_query, is_unchanged, make_stages
+from labels import filter_selector
+from limits import scope_limits
+from probe import node_problems, triage
+from strategies import DeployStrategy
+from models import Env, Group, Node, NodeDeployResult
+from config import DEPLOY_CONCURRENCY, DEPLOY_VERSION, PLAN_HISTORY
+
+
+def batch_estimate(durations, workers):
+    """
+    Estimate the seconds taken to deploy nodes of known durations on a number
+    of worker threads, each node going to the first free worker like in the
+    executor. Return None when a duration is unknown.
+    """
+    if None in durations:
+        return None
+    free = [0] * max(1, min(workers, len(durations)))
+    for duration in durations:
+        heapq.heappush(free, heapq.heappop(free) + duration)
+    return max(free) if durations else 0
+
+
+def total(estimates, combine = sum):
+    estimates = list(estimates)
+    if None in estimates:
+        return None
+    return combine(estimates) if estimates else 0
+
+
+def group_workers(grp_name):
+    """ Number of nodes of a group deployed at the same time, within the executor and the group limit. """
+    return min([DEPLOY_CONCURRENCY] + [limit for scope, limit in scope_limits(grp_name)])
+
+
+def deploy_plan(org, env = None, grp = None, strategy = None, order = None, version = DEPLOY_VERSION, force = False, selector = None):
+    """
+    Describe what a rollout of an organization, environment or group would do
+    without doing it: the nodes hit, in stages of groups deployed in batches,
+    with estimated durations in seconds, and the nodes the probe triage leaves
+    out, as start_rollout would.
+
+    The nodes and their mean duration over the successful deploys of the last
+    PLAN_HISTORY days come from a single query. Nodes never deployed are
+    estimated with the mean of the others, and estimates are None when no node
+    was ever deployed. Failures and retries are not foreseen.
+    """
+    strategy = strategy or DeployStrategy()
+    since = datetime.utcnow() - timedelta(days = PLAN_HISTORY)
+    query = scope_query([Group.name, Node.name, Node.ip, Node.fingerprint, db.func.avg(NodeDeployResult.duration)], org, env, grp) \
+        .outerjoin(NodeDeployResult, db.and_(NodeDeployResult.node_id == Node.id,
+            NodeDeployResult.exit_status == 0,
+            NodeDeployResult.started_at >= since)) \
+        .group_by(Env.id, Group.id, Group.name, Node.id, Node.name, Node.ip, Node.fingerprint)
+    query = filter_selector(query, selector)
+    groups = OrderedDict()
+    estimates = {}
+    unchanged = 0
+    for grp_name, node_name, ip, fingerprint, duration in query.order_by(Env.id, Group.id, Node.id):
+        if is_unchanged(grp_name, node_name, ip, fingerprint, None if force else version):
+            unchanged += 1
+        else:
+            groups.setdefault(grp_name, []).append((node_name, grp_name))
+            estimates[node_name] = None if duration is None else float(duration)
+    known = [duration for duration in estimates.values() if duration is not None]
+    default = sum(known) / len(known) if known else None
+    triaged, unhealthy = triage(make_stages(groups, order), node_problems(org, env, grp, selector))
+    stages = []
+    for stage in triaged:
+        stage_groups = []
+        for targets in stage:
+            grp_name = targets[0][1]
+            batches = []
+            for batch in strategy.batches(targets):
+                batch_durations = [default if estimates[node_name] is None else estimates[node_name] for node_name, grp_name in batch]
+                batches.append({
+                    'nodes': [node_name for node_name, grp_name in batch],
+                    'estimate': batch_estimate(batch_durations, group_workers(grp_name))
+                })
+            stage_groups.append({
+                'name': grp_name,
+                'batches': batches,
+                'estimate': total(batch['estimate'] for batch in batches)
+            })
+        # the groups of a stage are deployed at the same time, sharing the
+        # DEPLOY_CONCURRENCY workers of the executor
+        work = total(default if estimates[node_name] is None else estimates[node_name]
+            for targets in stage for node_name, grp_name in targets)
+        shared = None if work is None else work / DEPLOY_CONCURRENCY
+        stages.append({
+            'groups': stage_groups,
+            'estimate': total([total((group['estimate'] for group in stage_groups), max), shared], max)
+        })
+    return {
+        'nodes': len(estimates) - len(unhealthy),
+        'unchanged': unchanged,
+        'left_out': [{'name': node_name, 'group': grp_name, 'problem': problem} for node_name, grp_name, problem in unhealthy],
+        'stages': stages,
+        'estimate': total(stage['estimate'] for stage in stages)
+    }
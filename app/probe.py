@@ -0,0 +1,225 @@
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from app import app, db
+from decorators import async
+from run import Command
+from hierarchy import scope_query, bump_node_orgs
+from labels import filter_selector
+from models import Group, Node
+from config import PROBE_PORTS, PROBE_TIMEOUT, PROBE_CONCURRENCY, PROBE_BATCH, PROBE_TTL, PROBE_INTERVAL, \
+    PROBE_DISK_SCRIPT, PROBE_MIN_FD_SPACE, PROBE_UNHEALTHY
+
+# reachable is False when a port did not accept a connection, fd_space is the
+# free disk megabytes or None when unknown
+ProbeResult = namedtuple('ProbeResult', 'node_name reachable fd_space error')
+
+_prober_lock = threading.Lock()
+_prober_pid = None
+
+
+def disk_command(ip):
+    return PROBE_DISK_SCRIPT + " " + ip
+
+
+def probe_node(node_name, ip):
+    """
+    Connect to each of PROBE_PORTS of a node then run PROBE_DISK_SCRIPT, each
+    within PROBE_TIMEOUT seconds, and return a ProbeResult.
+    """
+    for port in PROBE_PORTS:
+        try:
+            socket.create_connection((ip, port), PROBE_TIMEOUT).close()
+        except socket.error as e:
+            return ProbeResult(node_name, False, None, 'port %d: %s' % (port, e))
+    if not PROBE_DISK_SCRIPT:
+        return ProbeResult(node_name, True, None, None)
+    status, output, error = Command(disk_command(ip)).run(timeout = PROBE_TIMEOUT)
+    try:
+        return ProbeResult(node_name, True, int(output.split()[-1]), None)
+    except (IndexError, ValueError):
+        return ProbeResult(node_name, True, None, 'disk space: %s' % (error or output or 'exit status %s' % status).strip())
+
+
+def probe_nodes(targets, concurrency = PROBE_CONCURRENCY):
+    """
+    Probe (node_name, ip) pairs on a pool of worker threads and return their
+    ProbeResults, in order.
+
+    Every connection and script has its own timeout, so unreachable nodes hold
+    a worker for PROBE_TIMEOUT seconds per port at most, and the others are
+    probed in the meantime.
+    """
+    targets = list(targets)
+    results = [None] * len(targets)
+    pending = iter(range(len(targets)))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(pending, None)
+            if i is None:
+                return
+            node_name, ip = targets[i]
+            try:
+                results[i] = probe_node(node_name, ip)
+            except Exception as e:
+                results[i] = ProbeResult(node_name, False, None, 'probe failure: %s' % e)
+
+    threads = [threading.Thread(target = worker) for _ in range(min(concurrency, len(targets)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def save_probes(results, now = None):
+    """
+    Store ProbeResults on their nodes with a single executemany statement,
+    without committing, and return the ids of the nodes whose reachability,
+    disk space or error changed.
+    """
+    if not results:
+        return []
+    node_ids = {}
+    previous = {}
+    for node_id, name, reachable, fd_space, error in db.session.query(Node.id, Node.name, Node.reachable, Node.fd_space, Node.probe_error) \
+            .filter(Node.name.in_([result.node_name for result in results])):
+        node_ids[name] = node_id
+        previous[name] = (reachable, fd_space, error)
+    node = Node.__table__
+    db.session.execute(node.update().where(node.c.name == db.bindparam('b_name')).values(
+            reachable = db.bindparam('b_reachable'),
+            fd_space = db.bindparam('b_fd_space'),
+            probe_error = db.bindparam('b_error'),
+            probed_at = now or datetime.utcnow()),
+        [{'b_name': result.node_name,
+          'b_reachable': result.reachable,
+          'b_fd_space': result.fd_space,
+          'b_error': result.error[:255] if result.error else None} for result in results])
+    return [node_ids[result.node_name] for result in results if result.node_name in node_ids
+        and previous[result.node_name] != (result.reachable, result.fd_space, result.error[:255] if result.error else None)]
+
+
+def claim_stale(now, limit = PROBE_BATCH):
+    """
+    Mark up to limit nodes whose probe is older than PROBE_TTL seconds as
+    probed now and return the (node_name, ip) pairs marked.
+
+    The mark only applies to the nodes still stale, so a node is probed by a
+    single prober process.
+    """
+    stale = db.or_(Node.probed_at == None, Node.probed_at < now - timedelta(seconds = PROBE_TTL))
+    node_ids = [node_id for node_id, in db.session.query(Node.id).filter(stale).order_by(Node.probed_at).limit(limit)]
+    if not node_ids:
+        return []
+    Node.query.filter(Node.id.in_(node_ids)).filter(stale).update({'probed_at': now}, synchronize_session = False)
+    db.session.commit()
+    return db.session.query(Node.name, Node.ip).filter(Node.id.in_(node_ids), Node.probed_at == now).all()
+
+
+def probe_round(now = None):
+    """ Probe the nodes whose probe is stale, PROBE_BATCH at a time, and return how many were probed. """
+    probed = 0
+    while True:
+        targets = claim_stale(now or datetime.utcnow())
+        if not targets:
+            return probed
+        results = probe_nodes(targets)
+        bump_node_orgs(save_probes(results))
+        db.session.commit()
+        probed += len(targets)
+
+
+def probe_loop():
+    while True:
+        try:
+            probe_round()
+        except:
+            app.logger.exception('node prober failure')
+        finally:
+            db.session.remove()
+        time.sleep(PROBE_INTERVAL)
+
+
+def start_prober():
+    """ Start the node prober thread of this process, once per process. """
+    global _prober_pid
+    with _prober_lock:
+        if _prober_pid == os.getpid():
+            return
+        _prober_pid = os.getpid()
+        thread = threading.Thread(target = probe_loop, name = 'node-prober')
+        thread.daemon = True
+        thread.start()
+
+
+@async
+def probe_now(targets):
+    """ Probe (node_name, ip) pairs in the background whatever the age of their probes. """
+    try:
+        for start in range(0, len(targets), PROBE_BATCH):
+            results = probe_nodes(targets[start:start + PROBE_BATCH])
+            bump_node_orgs(save_probes(results))
+            db.session.commit()
+    except:
+        app.logger.exception('node probe failure')
+    finally:
+        db.session.remove()
+
+
+def probe_problem(reachable, fd_space, error):
+    """ Why a probed node should not be deployed first, or None. """
+    if reachable is False:
+        return 'unreachable, %s' % error
+    if fd_space is not None and fd_space < PROBE_MIN_FD_SPACE:
+        return 'short of disk space, %d MB free' % fd_space
+    return None
+
+
+def node_problems(org, env = None, grp = None, selector = None, now = None):
+    """
+    Return a dict of node name to problem for the nodes of an organization,
+    environment or group that a probe of the last PROBE_TTL seconds found
+    unreachable or short of disk space, with a single query. Nodes without a
+    valid probe are taken as healthy.
+    """
+    fresh = (now or datetime.utcnow()) - timedelta(seconds = PROBE_TTL)
+    query = scope_query([Group.name, Node.name, Node.reachable, Node.fd_space, Node.probe_error], org, env, grp) \
+        .filter(Node.probed_at >= fresh) \
+        .filter(db.or_(Node.reachable == False, Node.fd_space < PROBE_MIN_FD_SPACE))
+    problems = {}
+    for grp_name, node_name, reachable, fd_space, error in filter_selector(query, selector):
+        problems[node_name] = probe_problem(reachable, fd_space, error)
+    return problems
+
+
+def triage(stages, problems, policy = PROBE_UNHEALTHY):
+    """
+    Apply a PROBE_UNHEALTHY policy to stages of groups of (node_name, grp_name)
+    pairs and return the stages and the (node_name, grp_name, problem) triples
+    left out: the nodes with problems are left out with 'skip', and moved to
+    the end of their group with 'last'.
+    """
+    if not problems or policy not in ('skip', 'last'):
+        return stages, []
+    triaged = []
+    skipped = []
+    for stage in stages:
+        groups = []
+        for targets in stage:
+            healthy = [target for target in targets if target[0] not in problems]
+            unhealthy = [target for target in targets if target[0] in problems]
+            if policy == 'skip':
+                skipped.extend((node_name, grp_name, problems[node_name]) for node_name, grp_name in unhealthy)
+                unhealthy = []
+            if healthy or unhealthy:
+                groups.append(healthy + unhealthy)
+        if groups:
+            triaged.append(groups)
+    return triaged, skipped
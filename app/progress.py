@@ -0,0 +1,103 @@
+import math
+import threading
+import time
+from config import PROGRESS_SAVE_INTERVAL
+
+_runs_lock = threading.Lock()
+_runs = {}
+
+
+def percentile(values, percent):
+    """ Nearest rank percentile of sorted values, None when there are none. """
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+
+class RunProgress(object):
+    """
+    Counters of a running deploy, updated by the DeployExecutor as nodes start
+    and finish, so a dashboard can follow thousands of nodes without reading
+    their results.
+
+    When a save function is given it is called with a snapshot at most every
+    PROGRESS_SAVE_INTERVAL seconds, so other processes can follow the run too.
+    """
+
+    def __init__(self, total, save=None):
+        self.lock = threading.Lock()
+        self.total = total
+        self.running = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.durations = []
+        self.started = time.time()
+        self.save = save
+        self.saved = 0
+
+    def node_started(self):
+        with self.lock:
+            self.running += 1
+
+    def node_retrying(self):
+        with self.lock:
+            self.running -= 1
+
+    def node_finished(self, result):
+        with self.lock:
+            if result.skipped:
+                self.skipped += 1
+            else:
+                self.running -= 1
+                if result.ok:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+                self.durations.append(result.duration)
+            save = self.save is not None and time.time() - self.saved >= PROGRESS_SAVE_INTERVAL
+            if save:
+                self.saved = time.time()
+        if save:
+            self.save(self.snapshot())
+
+    def snapshot(self):
+        """ Return the counters, the p50 and p95 node durations and the estimated seconds left. """
+        with self.lock:
+            done = self.succeeded + self.failed + self.skipped
+            durations = sorted(self.durations)
+            elapsed = time.time() - self.started
+            left = self.total - done
+            deployed = self.succeeded + self.failed
+            return {
+                'total': self.total,
+                'queued': left - self.running,
+                'running': self.running,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'elapsed': elapsed,
+                # the throughput so far accounts for the concurrency
+                'eta': left * elapsed / deployed if deployed else None
+            }
+
+
+def track(run_id, total, save=None):
+    """ Start following the progress of a deploy run in this process and return its RunProgress. """
+    progress = RunProgress(total, save)
+    with _runs_lock:
+        _runs[run_id] = progress
+    return progress
+
+
+def untrack(run_id):
+    with _runs_lock:
+        _runs.pop(run_id, None)
+
+
+def run_progress(run_id):
+    """ Return the RunProgress of a deploy run running in this process, or None. """
+    with _runs_lock:
+        return _runs.get(run_id)
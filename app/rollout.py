@@ -0,0 +1,124 @@
+import json
+from hashlib import sha1
+from datetime import datetime
+from app import app, db
+from decorators import async
+from executor import DeployExecutor, deploy_command
+from hierarchy import group_targets, make_stages
+from history import start_run, finish_run
+from jobs import job_key, run_once
+from models import DeployRun, RUN_FAILED
+from strategies import RetryPolicy
+from progress import track, untrack, run_progress
+from probe import node_problems, triage
+from config import DEPLOY_VERSION, DEPLOY_RETRIES, DEPLOY_RETRY_DELAY, DEPLOY_RETRY_MAX_DELAY
+
+
+def rollout_key(org, env = None, grp = None, selector = None):
+    if grp is not None:
+        key = job_key('update', 'grp', str(grp.id))
+    elif env is not None:
+        key = job_key('update', 'env', str(env.id))
+    else:
+        key = job_key('update', 'org', str(org.id))
+    # rollouts of different nodes of the same scope can run side by side
+    return job_key(key, sha1(selector).hexdigest()) if selector else key
+
+
+def start_rollout(org, env = None, grp = None, user = None, strategy_name = 'all', strategy = None, order = None, version = DEPLOY_VERSION, force = False,
+        selector = None):
+    """
+    Record a deploy run of a whole organization, environment or group and
+    deploy it in the background, following the group order, then return the run.
+    When the same rollout is already running that run is returned instead.
+
+    Nodes already deployed with the same version and unchanged since are
+    skipped, unless the rollout is forced. A label selector narrows the
+    rollout to the nodes it matches. Nodes a recent probe found unreachable or
+    short of disk space are skipped or deployed last, following PROBE_UNHEALTHY.
+    """
+    run, created = start_run(org = org, env = env, grp = grp, user = user, strategy = strategy_name, key = rollout_key(org, env, grp, selector),
+        version = version, selector = selector)
+    if created:
+        groups, run.unchanged = group_targets(org, env, grp, None if force else version, selector)
+        problems = node_problems(org, env, grp, selector)
+        db.session.add(run)
+        db.session.commit()
+        deploy_stages(run.id, make_stages(groups, order), strategy, problems)
+    return run
+
+
+def deploy_node_once(node_name, grp_name, log_path):
+    """
+    Deploy a node like executor.deploy_node, unless the node is already being deployed
+    by another request or rollout, in any worker process. Then wait for that
+    deploy to finish and return its result instead of starting a second one.
+    """
+    try:
+        job = run_once(deploy_command(node_name, grp_name), job_key('deploy', node_name, grp_name), log_path, grp_name)
+        return job.exit_code, job.output, job.error
+    finally:
+        db.session.remove()
+
+
+def save_progress(run_id):
+    """ Return a function saving a RunProgress snapshot of a deploy run for the other processes. """
+    def save(snapshot):
+        try:
+            DeployRun.query.filter_by(id = run_id).update({'progress': json.dumps(snapshot)}, synchronize_session = False)
+            db.session.commit()
+        finally:
+            db.session.remove()
+    return save
+
+
+def progress_snapshot(run):
+    """
+    Return the progress of a deploy run: from memory when it runs in this
+    process, else as last saved by the process running it.
+    """
+    progress = run_progress(run.id)
+    if progress is not None:
+        snapshot = progress.snapshot()
+    elif run.progress:
+        snapshot = json.loads(run.progress)
+    else:
+        snapshot = {'total': 0, 'queued': 0, 'running': 0, 'succeeded': 0, 'failed': 0, 'skipped': 0,
+            'p50': None, 'p95': None, 'elapsed': 0, 'eta': None}
+    if not run.is_running():
+        snapshot.update(queued = 0, running = 0, eta = 0,
+            succeeded = run.succeeded, failed = run.failed, skipped = run.skipped)
+    snapshot['status'] = run.status_name()
+    snapshot['finished'] = not run.is_running()
+    return snapshot
+
+
+@async
+def deploy_stages(run_id, stages, strategy, problems = None):
+    progress = track(run_id, sum(len(targets) for stage in stages for targets in stage), save_progress(run_id))
+    try:
+        run = DeployRun.query.get(run_id)
+        executor = DeployExecutor(deploy = deploy_node_once, log_dir = run.log_dir(),
+            retry = RetryPolicy(DEPLOY_RETRIES, DEPLOY_RETRY_DELAY, DEPLOY_RETRY_MAX_DELAY),
+            progress = progress)
+        stages, unhealthy = triage(stages, problems)
+        results = []
+        for node_name, grp_name, problem in unhealthy:
+            results.extend(executor.skip([(node_name, grp_name)], 'Skipped, the node is %s.' % problem))
+        results.extend(executor.run_stages(stages, strategy))
+        run = DeployRun.query.get(run_id)
+        run.progress = json.dumps(progress.snapshot())
+        run = finish_run(run, results)
+        app.logger.info('deploy run %d %s: %d succeeded, %d failed, %d skipped, %d retried' % (run.id,
+            run.status_name(), run.succeeded, run.failed, run.skipped, run.retried))
+    except:
+        app.logger.exception('deploy run %d failure' % run_id)
+        db.session.rollback()
+        DeployRun.query.filter_by(id = run_id).update({
+            'status': RUN_FAILED,
+            'inflight_key': None,
+            'finished_at': datetime.utcnow() }, synchronize_session = False)
+        db.session.commit()
+    finally:
+        untrack(run_id)
+        db.session.remove()
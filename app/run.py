@@ -1,20 +1,37 @@
 #! /usr/bin/env python
+import os
+import sys
+import signal
 import threading
 import subprocess
 import traceback
 import shlex
+import time
+from collections import namedtuple
+
+# seconds a killed process group gets to exit before it is killed for good
+KILL_GRACE_PERIOD = 5
+
+# wall_time and cpu_time are in seconds, max_rss in kilobytes; cpu_time and
+# max_rss are not available on Windows and are left as None there
+ResourceUsage = namedtuple('ResourceUsage', 'wall_time cpu_time max_rss')
 
 
 class Command(object):
     """
     Enables to run subprocess commands in a different thread with TIMEOUT option.
 
+    The command runs in its own process group, so on timeout the whole tree of
+    processes started by the shell is killed and not only the shell. After a
+    run the resources used by the command are available in `usage`.
+
     Based on jcollado's solution:
     http://stackoverflow.com/questions/1191374/subprocess-with-timeout/4825933#4825933
     """
     command = None
     process = None
     status = None
+    usage = None
     output, error = '', ''
 
     def __init__(self, command):
@@ -22,26 +39,82 @@ class Command(object):
             command = shlex.split(command, posix = False)
         self.command = command
 
-    def run(self, timeout=None, **kwargs):
-        """ Run a command then return: (status, output, error). """
+    def wait(self):
+        """ Reap the process, recording its resource usage, and return its exit status. """
+        if not hasattr(os, 'wait4'):
+            return self.process.wait(), None, None
+        pid, status, rusage = os.wait4(self.process.pid, 0)
+        if os.WIFSIGNALED(status):
+            self.process.returncode = -os.WTERMSIG(status)
+        else:
+            self.process.returncode = os.WEXITSTATUS(status)
+        return self.process.returncode, rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss
+
+    def kill(self, force=False):
+        """ Kill the process group of the command, politely unless forced. """
+        if sys.platform == 'win32':
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(self.process.pid)])
+        else:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL if force else signal.SIGTERM)
+            except OSError:
+                pass
+
+    def run(self, timeout=None, output_handler=None, **kwargs):
+        """
+        Run a command then return: (status, output, error).
+
+        When an output_handler is given stderr is merged into stdout and every
+        line is passed to the handler as soon as it is printed, instead of being
+        kept in memory; output is then returned empty.
+        """
+        def read(pipe, lines):
+            lines.append(pipe.read())
+
         def target(**kwargs):
+            started = time.time()
+            cpu_time = max_rss = None
             try:
                 self.process = subprocess.Popen(self.command, **kwargs)
-                self.output, self.error = self.process.communicate()
-                self.status = self.process.returncode
+                if output_handler is None:
+                    # like communicate() but leaves the reaping to wait()
+                    output, error = [], []
+                    readers = [threading.Thread(target=read, args=(pipe, lines))
+                        for pipe, lines in ((self.process.stdout, output), (self.process.stderr, error)) if pipe is not None]
+                    for reader in readers:
+                        reader.start()
+                    for reader in readers:
+                        reader.join()
+                    self.output, self.error = ''.join(output), ''.join(error)
+                else:
+                    for line in iter(self.process.stdout.readline, ''):
+                        output_handler(line)
+                self.status, cpu_time, max_rss = self.wait()
             except:
                 self.error = traceback.format_exc()
                 self.status = -1
+            self.usage = ResourceUsage(time.time() - started, cpu_time, max_rss)
         # default stdout and stderr
         if 'stdout' not in kwargs:
             kwargs['stdout'] = subprocess.PIPE
         if 'stderr' not in kwargs:
-            kwargs['stderr'] = subprocess.PIPE
+            if output_handler is None:
+                kwargs['stderr'] = subprocess.PIPE
+            else:
+                kwargs['stderr'] = subprocess.STDOUT
+        # own process group
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = kwargs.get('creationflags', 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['preexec_fn'] = os.setsid
         # thread
         thread = threading.Thread(target=target, kwargs=kwargs)
         thread.start()
         thread.join(timeout)
-        if thread.is_alive():
-            self.process.terminate()
-            thread.join()
+        if thread.is_alive() and self.process is not None:
+            self.kill()
+            thread.join(KILL_GRACE_PERIOD)
+            if thread.is_alive():
+                self.kill(force=True)
+        thread.join()
         return self.status, self.output, self.error
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from app import app, db
+from cron import CronSchedule
+from rollout import start_rollout
+from strategies import make_strategy
+from models import DeploySchedule, CATCH_UP_ONCE
+from config import SCHEDULER_INTERVAL, SCHEDULE_GRACE, DEPLOY_VERSION
+
+_scheduler_lock = threading.Lock()
+_scheduler_pid = None
+
+
+def next_run(schedule, after):
+    """ Return when a schedule is due next after a datetime, or None for a one-off schedule. """
+    if not schedule.cron:
+        return None
+    return CronSchedule(schedule.cron).next_after(after)
+
+
+def claim_due(now):
+    """
+    Move the due schedules to their next run and return the ids of those to
+    deploy now.
+
+    The move only succeeds when the run time was not moved already, so a due
+    schedule is deployed by a single worker process. A schedule overdue by more
+    than SCHEDULE_GRACE seconds, because no scheduler was running, is deployed
+    once if its policy says so, and never more than once however many runs were
+    missed.
+    """
+    due = []
+    for schedule in DeploySchedule.query.filter(DeploySchedule.enabled == True, DeploySchedule.run_at <= now).order_by(DeploySchedule.run_at).all():
+        run_at = schedule.run_at
+        missed = now - run_at > timedelta(seconds = SCHEDULE_GRACE)
+        catch_up = schedule.catch_up == CATCH_UP_ONCE
+        following = next_run(schedule, now)
+        claimed = DeploySchedule.query.filter_by(id = schedule.id, run_at = run_at).update({
+            'run_at': following,
+            'enabled': following is not None }, synchronize_session = False)
+        db.session.commit()
+        if claimed and (catch_up or not missed):
+            due.append(schedule.id)
+        elif claimed:
+            app.logger.info('deploy schedule %d skipped the deploy missed at %s' % (schedule.id, run_at))
+    return due
+
+
+def fire(schedule_id):
+    """ Start the rollout of a schedule and return its DeployRun. """
+    schedule = DeploySchedule.query.get(schedule_id)
+    run = start_rollout(schedule.org, schedule.env, schedule.grp,
+        user = schedule.user,
+        strategy_name = schedule.strategy,
+        strategy = make_strategy(schedule.strategy, schedule.size, schedule.max_failures),
+        order = schedule.order,
+        version = schedule.version or DEPLOY_VERSION,
+        force = bool(schedule.force))
+    DeploySchedule.query.filter_by(id = schedule_id).update({
+        'last_run_id': run.id,
+        'last_run_at': datetime.utcnow() }, synchronize_session = False)
+    db.session.commit()
+    return run
+
+
+def tick(now = None):
+    """ Start the rollouts of the schedules due at a time, now by default. """
+    for schedule_id in claim_due(now or datetime.utcnow()):
+        try:
+            fire(schedule_id)
+        except:
+            app.logger.exception('deploy schedule %d failure' % schedule_id)
+            db.session.rollback()
+
+
+def schedule_loop():
+    while True:
+        try:
+            tick()
+        except:
+            app.logger.exception('deploy scheduler failure')
+        finally:
+            db.session.remove()
+        time.sleep(SCHEDULER_INTERVAL)
+
+
+def start_scheduler():
+    """ Start the deploy scheduler thread of this process, once per process. """
+    global _scheduler_pid
+    with _scheduler_lock:
+        if _scheduler_pid == os.getpid():
+            return
+        _scheduler_pid = os.getpid()
+        thread = threading.Thread(target = schedule_loop, name = 'deploy-scheduler')
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,95 @@
+import math
+import random
+
+
+class DeployStrategy(object):
+    """
+    Splits the nodes of a rollout in batches deployed one after the other.
+
+    The rollout halts, and the remaining batches are skipped, as soon as more
+    than `max_failures` nodes have failed.
+    """
+
+    def __init__(self, max_failures=0):
+        self.max_failures = max(0, max_failures)
+
+    def batches(self, targets):
+        return [targets] if targets else []
+
+    def halted(self, failures):
+        return failures > self.max_failures
+
+
+class CanaryStrategy(DeployStrategy):
+    """ Deploys a few canary nodes first, then all the others. """
+
+    def __init__(self, canaries=1, max_failures=0):
+        DeployStrategy.__init__(self, max_failures)
+        self.canaries = max(1, canaries)
+
+    def batches(self, targets):
+        return [batch for batch in (targets[:self.canaries], targets[self.canaries:]) if batch]
+
+
+class RollingStrategy(DeployStrategy):
+    """ Deploys fixed size batches of nodes. """
+
+    def __init__(self, batch_size=1, max_failures=0):
+        DeployStrategy.__init__(self, max_failures)
+        self.batch_size = max(1, batch_size)
+
+    def batch_size_for(self, targets):
+        return self.batch_size
+
+    def batches(self, targets):
+        size = self.batch_size_for(targets)
+        return [targets[i:i + size] for i in range(0, len(targets), size)]
+
+
+class PercentageStrategy(RollingStrategy):
+    """ Deploys batches of a percentage of the nodes. """
+
+    def __init__(self, percent=10, max_failures=0):
+        RollingStrategy.__init__(self, 1, max_failures)
+        self.percent = min(100, max(1, percent))
+
+    def batch_size_for(self, targets):
+        return max(1, int(math.ceil(len(targets) * self.percent / 100.0)))
+
+
+class RetryPolicy(object):
+    """
+    Retries the nodes that failed to deploy, with an exponential backoff.
+
+    The delay doubles at every attempt up to `max_delay`, and a random part of
+    it, up to `jitter`, is taken off so the retries of nodes that failed
+    together do not all hit the chef server at the same time.
+    """
+
+    def __init__(self, retries=0, delay=5, max_delay=60, jitter=0.5):
+        self.retries = max(0, retries)
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = min(1, max(0, jitter))
+
+    def should_retry(self, attempt):
+        """ Whether a node that failed on its `attempt`th attempt, from 1, is tried again. """
+        return attempt <= self.retries
+
+    def backoff(self, attempt):
+        """ Seconds to wait before the attempt following the `attempt`th one. """
+        delay = min(self.max_delay, self.delay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+STRATEGIES = {
+    'all': lambda size, max_failures: DeployStrategy(max_failures),
+    'canary': lambda size, max_failures: CanaryStrategy(size or 1, max_failures),
+    'rolling': lambda size, max_failures: RollingStrategy(size or 1, max_failures),
+    'percent': lambda size, max_failures: PercentageStrategy(size or 10, max_failures)
+}
+
+
+def make_strategy(name, size=None, max_failures=0):
+    """ Build a strategy by name, `size` is the number of canaries, the batch size or the percentage. """
+    return STRATEGIES.get(name, STRATEGIES['all'])(size, max_failures or 0)
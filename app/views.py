@@ -1,16 +1,32 @@
-from flask import render_template, flash, redirect, session, url_for, request, g, jsonify
+from flask import render_template, flash, redirect, session, url_for, request, g, jsonify, Response, abort
 from flask.ext.login import login_user, logout_user, current_user, login_required
 from flask.ext.sqlalchemy import get_debug_queries
 from flask.ext.babel import gettext
 from app import app, db, lm, oid, babel
-from run import Command
-from forms import LoginForm, EditForm, PostForm, SearchForm, MCEditForm, OrgEditForm, EnvEditForm, GrpEditForm, NodeEditForm
-from models import User, ROLE_USER, ROLE_ADMIN, Post, MCSetting, Organization, Env, Group, Node
+from executor import deploy_command
+from rollout import start_rollout, progress_snapshot
+from bootstrap import pending_bootstrap, bootstrap_nodes, start_bootstrap
+from scheduler import start_scheduler, next_run
+from probe import start_prober, probe_now
+from plan import deploy_plan
+from hierarchy import cached_tree, bump_tree_version, resolve_path, group_counts, node_page, NodeCounts, scope_query
+from labels import parse_selector, format_selector, parse_labels, format_labels, node_labels, set_labels
+from inventory import parse_nodes, import_nodes, export_nodes, export_lines, EXPORT_FORMATS
+from jobs import enqueue, start_workers, follow_log, job_key
+from limits import queue_depth
+from capture import LogReader
+from strategies import make_strategy
+from forms import LoginForm, EditForm, PostForm, SearchForm, MCEditForm, OrgEditForm, EnvEditForm, GrpEditForm, NodeEditForm, ScheduleForm
+from models import User, ROLE_USER, ROLE_ADMIN, Post, MCSetting, Organization, Env, Group, Node, Job, DeployRun, NodeDeployResult, DeploySchedule
 from datetime import datetime
+import csv
+import json
+import time
 from emails import follower_notification
 from guess_language import guessLanguage
 from translate import microsoft_translate
-from config import POSTS_PER_PAGE, MAX_SEARCH_RESULTS, LANGUAGES, DATABASE_QUERY_TIMEOUT, WHOOSH_ENABLED
+from config import POSTS_PER_PAGE, MAX_SEARCH_RESULTS, LANGUAGES, DATABASE_QUERY_TIMEOUT, WHOOSH_ENABLED, LOG_LINES_PER_PAGE, DEPLOY_VERSION, PROGRESS_POLL_INTERVAL, \
+    NODES_PER_PAGE, MAX_NODES_PER_PAGE
 
 @lm.user_loader
 def load_user(id):
@@ -20,6 +36,13 @@ def load_user(id):
 def get_locale():
     return request.accept_languages.best_match(LANGUAGES.keys())
     
+@app.before_first_request
+def before_first_request():
+    # pick up the jobs left in the queue by a previous worker process
+    start_workers()
+    start_scheduler()
+    start_prober()
+
 @app.before_request
 def before_request():
     g.user = current_user
@@ -186,7 +209,7 @@ def mc_edit(name):
 def org_add():
     form = OrgEditForm(g.user, "")
     if form.validate_on_submit():
-        org = Organization(name = form.name.data, user = g.user, timestamp = datetime.utcnow())
+        org = Organization(name = form.name.data, user = g.user, timestamp = datetime.utcnow(), tree_version = 0)
         db.session.add(org)
         db.session.commit()
         flash(gettext('Your settings have been saved.'))
@@ -201,6 +224,7 @@ def org_edit(name):
     if form.validate_on_submit():
         org.name = form.name.data
         db.session.add(org)
+        bump_tree_version(org.id)
         db.session.commit()
         flash(gettext('Your changes have been saved.'))
         return redirect(url_for('org_edit', name = org.name))
@@ -210,14 +234,24 @@ def org_edit(name):
         form = form)
 
 
+def path_or_404(org_name, env_name = None, grp_name = None, node_name = None):
+    """ Resolve the names of a URL for the current user once per request, or abort with a 404. """
+    if not hasattr(g, 'paths'):
+        g.paths = {}
+    key = (org_name, env_name, grp_name, node_name)
+    if key not in g.paths:
+        g.paths[key] = resolve_path(g.user, org_name, env_name, grp_name, node_name)
+    if g.paths[key] is None:
+        abort(404)
+    return g.paths[key]
+
 @app.route('/org_deploy/<name>', methods = ['GET', 'POST'])
 @login_required
 def org_deploy(name):
-    org = g.user.organizations.filter_by(name = name).first()
-    envs = org.envs.all()
+    org = path_or_404(name).org
     return render_template('org_deploy.html',
         org = org,
-        envs = envs)
+        tree = cached_tree(org))
 
 @app.route('/env_add/<org_name>', methods = ['POST'])
 @login_required
@@ -227,6 +261,7 @@ def env_add(org_name):
     if form.validate_on_submit():
         env = Env(name = form.name.data, org = org, timestamp = datetime.utcnow())
         db.session.add(env)
+        bump_tree_version(org.id)
         db.session.commit()
         flash(gettext('Your settings have been saved.'))
         return redirect(url_for('org_deploy', name = org.name))
@@ -235,27 +270,59 @@ def env_add(org_name):
 @app.route('/grp_add/<org_name>/<env_name>', methods = ['POST'])
 @login_required
 def grp_add(org_name, env_name):
-    org = g.user.organizations.filter_by(name = org_name).first()
-    env = org.envs.filter_by(name = env_name).first()
+    org, env, grp, node = path_or_404(org_name, env_name)
     form = GrpEditForm(org, env, "")
     if form.validate_on_submit():
         grp = Group(name = form.name.data, env = env, timestamp = datetime.utcnow())
         db.session.add(grp)
+        bump_tree_version(org.id)
         db.session.commit()
         flash(gettext('Your settings have been saved.'))
         return redirect(url_for('org_deploy', name = org.name))
     return render_template('grp_edit.html', form = form)
 
+@app.route('/nodes/<org_name>/<env_name>/<grp_name>')
+@login_required
+def grp_nodes(org_name, env_name, grp_name):
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name)
+    after = request.args.get('after')
+    nodes, next_after = node_page(grp, after)
+    return render_template('grp_nodes.html',
+        org = org,
+        env = env,
+        grp = grp,
+        counts = group_counts(org, grp = grp).get(grp.id, NodeCounts(0, 0)),
+        nodes = nodes,
+        after = after,
+        next_after = next_after)
+
+@app.route('/nodes/<org_name>/<env_name>/<grp_name>/json')
+@login_required
+def grp_nodes_json(org_name, env_name, grp_name):
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name)
+    size = max(1, min(request.args.get('limit', NODES_PER_PAGE, type = int), MAX_NODES_PER_PAGE))
+    try:
+        nodes, next_after = node_page(grp, request.args.get('after'), size, request.args.get('selector'))
+    except ValueError:
+        abort(400)
+    counts = group_counts(org, grp = grp).get(grp.id, NodeCounts(0, 0))
+    return jsonify(
+        total = counts.total,
+        bootstrapped = counts.bootstrapped,
+        nodes = [node.to_dict() for node in nodes],
+        next = next_after)
+
 @app.route('/node_add/<org_name>/<env_name>/<grp_name>', methods = ['POST'])
 @login_required
 def node_add(org_name, env_name, grp_name):
-    org = g.user.organizations.filter_by(name = org_name).first()
-    env = org.envs.filter_by(name = env_name).first()
-    grp = env.groups.filter_by(name = grp_name).first()
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name)
     form = NodeEditForm(org, env, grp, "")
     if form.validate_on_submit():
         node = Node(name = form.name.data, grp =grp, timestamp = datetime.utcnow(), ip = form.ip.data)
         db.session.add(node)
+        db.session.flush()
+        set_labels({node.id: form.label_values})
+        bump_tree_version(org.id)
         db.session.commit()
         flash(gettext('Your settings have been saved.'))
         return redirect(url_for('org_deploy', name = org.name))
@@ -264,59 +331,329 @@ def node_add(org_name, env_name, grp_name):
 @app.route('/node_edit/<org_name>/<env_name>/<grp_name>/<node_name>', methods = ['GET', 'POST'])
 @login_required
 def node_edit(org_name, env_name, grp_name, node_name):
-    org = g.user.organizations.filter_by(name = org_name).first()
-    env = org.envs.filter_by(name = env_name).first()
-    grp = env.groups.filter_by(name = grp_name).first()
-    node = grp.nodes.filter_by(name = node_name).first()
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name, node_name)
     form = NodeEditForm(org, env, grp, node.name)
     if form.validate_on_submit():
         node.name = form.name.data
         node.ip = form.ip.data
         db.session.add(node)
+        set_labels({node.id: form.label_values})
+        bump_tree_version(org.id)
         db.session.commit()
         flash(gettext('Your changes have been saved.'))
         return redirect(url_for('org_deploy', name = org.name))
     elif request.method != "POST":
         form.name.data = node.name
         form.ip.data = node.ip
+        form.labels.data = format_labels(node_labels(node))
     return render_template('node_edit.html',
         form = form)
 
+@app.route('/node_import/<org_name>/<env_name>', methods = ['GET', 'POST'])
+@login_required
+def node_import(org_name, env_name):
+    org, env, grp, node = path_or_404(org_name, env_name)
+    imported = None
+    errors = []
+    if request.method == 'POST':
+        upload = request.files.get('nodes')
+        if upload and upload.filename:
+            data = upload.read()
+            format = 'json' if upload.filename.lower().endswith('.json') else 'csv'
+        else:
+            data = request.form.get('data', '').encode('utf-8')
+            format = request.form.get('format', 'csv')
+        try:
+            rows = parse_nodes(data, format)
+        except (ValueError, csv.Error) as e:
+            flash(gettext('The nodes could not be read: %(error)s', error = e))
+        else:
+            imported, errors = import_nodes(org, env, rows)
+            flash(gettext('%(count)d nodes imported.', count = imported))
+            if not errors:
+                return redirect(url_for('org_deploy', name = org.name))
+    return render_template('node_import.html',
+        org = org,
+        env = env,
+        imported = imported,
+        errors = errors)
+
+@app.route('/export/<org_name>')
+@app.route('/export/<org_name>/<env_name>')
+@app.route('/export/<org_name>/<env_name>/<grp_name>')
+@login_required
+def export(org_name, env_name = None, grp_name = None):
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name)
+    format = request.args.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        abort(400)
+    def lines():
+        try:
+            for line in export_lines(export_nodes(org, env, grp), format):
+                yield line
+        finally:
+            db.session.remove()
+    filename = '-'.join(name for name in (org_name, env_name, grp_name) if name)
+    return Response(lines(), mimetype = EXPORT_FORMATS[format], headers = {
+        'Content-Disposition': 'attachment; filename=%s.%s' % (filename, 'json' if format == 'chef' else format) })
+
 @app.route('/run/<name>', methods = ['GET', 'POST'])
 @login_required
 def run(name):
-    command = Command("echo 'Process started'; sleep 2; echo 'Process finished'")
-    output = command.run(timeout=1, shell=True)
-    return render_template('output.html',
-        output = output)
+    job = enqueue("echo 'Process started'; sleep 2; echo 'Process finished'", user = g.user, timeout = 1)
+    return redirect(url_for('job', id = job.id))
 
 @app.route('/bootstrap/<ip>/<grp_name>', methods = ['GET', 'POST'])
 @login_required
 def bootstrap(ip, grp_name):
-    command = Command("c:\\Users\\sgopalak\\chef-repo\\bootstrap.bat " + ip + " " + grp_name)
-    output = command.run(timeout=None, shell=True)
-    return render_template('output.html',
-        output = output)
+    node = Node.query.join(Group, Node.grp_id == Group.id) \
+        .join(Env, Group.env_id == Env.id) \
+        .join(Organization, Env.org_id == Organization.id) \
+        .filter(Node.ip == ip, Group.name == grp_name, Organization.user_id == g.user.id).first_or_404()
+    if node.is_bootstrapped() and 'force' not in request.values:
+        flash(gettext('%(name)s is already bootstrapped.', name = node.name))
+        return redirect(url_for('org_deploy', name = node.grp.env.org.name))
+    job = start_bootstrap(node, grp_name, user = g.user)
+    return redirect(url_for('job', id = job.id))
+
+@app.route('/bootstrap_grp/<org_name>/<env_name>/<grp_name>', methods = ['POST'])
+@login_required
+def bootstrap_grp(org_name, env_name, grp_name):
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name)
+    targets = pending_bootstrap(org, env, grp)
+    bootstrap_nodes(targets)
+    flash(gettext('Bootstrap of %(count)s nodes started.', count = len(targets)))
+    return redirect(url_for('org_deploy', name = org.name))
+
+@app.route('/probe/<org_name>', methods = ['POST'])
+@app.route('/probe/<org_name>/<env_name>', methods = ['POST'])
+@app.route('/probe/<org_name>/<env_name>/<grp_name>', methods = ['POST'])
+@login_required
+def probe(org_name, env_name = None, grp_name = None):
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name)
+    targets = scope_query([Group.name, Node.name, Node.ip], org, env, grp).order_by(Node.id).all()
+    probe_now([(node_name, ip) for grp_name, node_name, ip in targets])
+    flash(gettext('Probe of %(count)s nodes started.', count = len(targets)))
+    return redirect(url_for('org_deploy', name = org.name))
+
+@app.route('/bootstrap_env/<org_name>/<env_name>', methods = ['POST'])
+@login_required
+def bootstrap_env(org_name, env_name):
+    org, env, grp, node = path_or_404(org_name, env_name)
+    targets = pending_bootstrap(org, env)
+    bootstrap_nodes(targets)
+    flash(gettext('Bootstrap of %(count)s nodes started.', count = len(targets)))
+    return redirect(url_for('org_deploy', name = org.name))
 
 @app.route('/deploy/<node_name>/<grp_name>', methods = ['GET', 'POST'])
 @login_required
 def deploy(node_name, grp_name):
-    command = Command("c:\\Users\\sgopalak\\chef-repo\\deploy.bat " + node_name + " " + grp_name)
-    output = command.run(timeout=None, shell=True)
-    return render_template('output.html',
-        output = output)
-        
+    job = enqueue(deploy_command(node_name, grp_name), user = g.user, key = job_key('deploy', node_name, grp_name), grp_name = grp_name)
+    return redirect(url_for('job', id = job.id))
+
+def job_or_404(id):
+    """
+    Load a job queued by the current user or run on a group of one of their
+    organizations, or abort with a 404.
+    """
+    return Job.query.outerjoin(Group, Group.name == Job.grp_name) \
+        .outerjoin(Env, Group.env_id == Env.id) \
+        .outerjoin(Organization, Env.org_id == Organization.id) \
+        .filter(Job.id == id, db.or_(Job.user_id == g.user.id, Organization.user_id == g.user.id)).first_or_404()
+
+@app.route('/job/<int:id>')
+@app.route('/job/<int:id>/<int:page>')
+@login_required
+def job(id, page = 1):
+    job = job_or_404(id)
+    lines, more = [], False
+    if job.is_finished():
+        lines, more = LogReader(job.log_path()).page(page, LOG_LINES_PER_PAGE)
+    return render_template('job.html',
+        job = job,
+        lines = lines,
+        page = page,
+        more = more)
+
+@app.route('/job/<int:id>/status')
+@login_required
+def job_status(id):
+    job = job_or_404(id)
+    return jsonify(job.to_dict())
+
+@app.route('/deploy_queue')
+@login_required
+def deploy_queue():
+    return jsonify(queue_depth())
+
+@app.route('/job/<int:id>/stream')
+@login_required
+def job_stream(id):
+    job = job_or_404(id)
+    def events():
+        for line in follow_log(job):
+            yield 'data: %s\n\n' % line.rstrip('\r\n')
+        yield 'event: finished\ndata: %d\n\n' % job.id
+    return Response(events(), mimetype = 'text/event-stream')
+
+def rollout_strategy():
+    """ Return the name and the DeployStrategy of a rollout form. """
+    name = request.values.get('strategy', 'all')
+    return name, make_strategy(name,
+        request.values.get('size', None, type = int),
+        request.values.get('max_failures', 0, type = int))
+
+def rollout_version():
+    """ Return the version and the force flag of a rollout form. """
+    return request.values.get('version') or DEPLOY_VERSION, 'force' in request.values
+
+def rollout_selector():
+    """ Return the canonical label selector of a rollout form, None when it has none. """
+    try:
+        selector = format_selector(parse_selector(request.values.get('selector')))
+    except ValueError:
+        abort(400)
+    if len(selector) > 255:
+        abort(400)
+    return selector or None
+
+@app.route('/plan/<org_name>')
+@app.route('/plan/<org_name>/<env_name>')
+@app.route('/plan/<org_name>/<env_name>/<grp_name>')
+@login_required
+def plan(org_name, env_name = None, grp_name = None):
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name)
+    strategy_name, strategy = rollout_strategy()
+    version, force = rollout_version()
+    return jsonify(deploy_plan(org, env, grp, strategy = strategy, order = request.values.get('order'),
+        version = version, force = force, selector = rollout_selector()))
+
 @app.route('/update_grp/<org_name>/<env_name>/<grp_name>', methods = ['POST'])
 @login_required
 def update_grp(org_name, env_name, grp_name):
-    org = g.user.organizations.filter_by(name = org_name).first()
-    env = org.envs.filter_by(name = env_name).first()
-    envs = org.envs.all()
-    grp = env.groups.filter_by(name = grp_name).first()
-    nodes = grp.nodes.all()
-    for node in nodes:
-        deploy(node.name, grp.name)
-    return render_template('org_deploy.html', org = org, envs = envs)
+    org, env, grp, node = path_or_404(org_name, env_name, grp_name)
+    strategy_name, strategy = rollout_strategy()
+    version, force = rollout_version()
+    run = start_rollout(org, env, grp, user = g.user, strategy_name = strategy_name, strategy = strategy,
+        version = version, force = force, selector = rollout_selector())
+    return redirect(url_for('deploy_run', id = run.id))
+
+@app.route('/update_env/<org_name>/<env_name>', methods = ['POST'])
+@login_required
+def update_env(org_name, env_name):
+    org, env, grp, node = path_or_404(org_name, env_name)
+    strategy_name, strategy = rollout_strategy()
+    version, force = rollout_version()
+    run = start_rollout(org, env, user = g.user, strategy_name = strategy_name, strategy = strategy,
+        version = version, force = force, order = request.form.get('order'), selector = rollout_selector())
+    return redirect(url_for('deploy_run', id = run.id))
+
+@app.route('/update_org/<org_name>', methods = ['POST'])
+@login_required
+def update_org(org_name):
+    org = path_or_404(org_name).org
+    strategy_name, strategy = rollout_strategy()
+    version, force = rollout_version()
+    run = start_rollout(org, user = g.user, strategy_name = strategy_name, strategy = strategy,
+        version = version, force = force, order = request.form.get('order'), selector = rollout_selector())
+    return redirect(url_for('deploy_run', id = run.id))
+
+@app.route('/schedules/<org_name>', methods = ['GET', 'POST'])
+@login_required
+def schedules(org_name):
+    org = path_or_404(org_name).org
+    form = ScheduleForm(org)
+    if form.validate_on_submit():
+        kind, id = form.scope.data.split(':')
+        grp = Group.query.get(int(id)) if kind == 'grp' else None
+        env = grp.env if grp is not None else Env.query.get(int(id))
+        schedule = DeploySchedule(org = org, env = env, grp = grp, user = g.user,
+            cron = form.cron.data or None,
+            catch_up = form.catch_up.data,
+            strategy = form.strategy.data,
+            size = form.size.data,
+            max_failures = form.max_failures.data or 0,
+            order = form.order.data or None,
+            version = form.version.data or None,
+            force = form.force.data,
+            enabled = True,
+            timestamp = datetime.utcnow())
+        schedule.run_at = form.run_at.data or next_run(schedule, datetime.utcnow())
+        db.session.add(schedule)
+        db.session.commit()
+        flash(gettext('Your settings have been saved.'))
+        return redirect(url_for('schedules', org_name = org.name))
+    return render_template('schedules.html',
+        org = org,
+        form = form,
+        schedules = org.schedules.order_by(DeploySchedule.id).all())
+
+@app.route('/schedule_delete/<int:id>', methods = ['POST'])
+@login_required
+def schedule_delete(id):
+    schedule = DeploySchedule.query.get_or_404(id)
+    org_name = schedule.org.name
+    if schedule.org.user_id != g.user.id:
+        abort(403)
+    db.session.delete(schedule)
+    db.session.commit()
+    flash(gettext('The schedule has been deleted.'))
+    return redirect(url_for('schedules', org_name = org_name))
+
+def run_or_404(id):
+    """ Load a deploy run of an organization of the current user, or abort with a 404. """
+    return DeployRun.query.join(Organization, DeployRun.org_id == Organization.id) \
+        .filter(DeployRun.id == id, Organization.user_id == g.user.id).first_or_404()
+
+@app.route('/deploy_run/<int:id>')
+@login_required
+def deploy_run(id):
+    run = run_or_404(id)
+    results = run.results.options(db.joinedload('node')).order_by(NodeDeployResult.id).all()
+    return render_template('grp_output.html',
+        run = run,
+        results = results)
+
+@app.route('/deploy_run/<int:id>/progress')
+@login_required
+def deploy_run_progress(id):
+    return jsonify(progress_snapshot(run_or_404(id)))
+
+@app.route('/deploy_run/<int:id>/progress/stream')
+@login_required
+def deploy_run_progress_stream(id):
+    run = run_or_404(id)
+    def events():
+        try:
+            while True:
+                # the commit ends the transaction and expires the loaded run
+                db.session.commit()
+                snapshot = progress_snapshot(DeployRun.query.get(id))
+                yield 'data: %s\n\n' % json.dumps(snapshot)
+                if snapshot['finished']:
+                    yield 'event: finished\ndata: %d\n\n' % id
+                    return
+                time.sleep(PROGRESS_POLL_INTERVAL)
+        finally:
+            db.session.remove()
+    return Response(events(), mimetype = 'text/event-stream')
+
+@app.route('/deploy_log/<int:id>')
+@app.route('/deploy_log/<int:id>/<int:page>')
+@login_required
+def deploy_log(id, page = 1):
+    result = NodeDeployResult.query.join(DeployRun, NodeDeployResult.run_id == DeployRun.id) \
+        .join(Organization, DeployRun.org_id == Organization.id) \
+        .filter(NodeDeployResult.id == id, Organization.user_id == g.user.id).first_or_404()
+    reader = LogReader(result.log or '')
+    if not reader.exists():
+        abort(404)
+    lines, more = reader.page(page, LOG_LINES_PER_PAGE)
+    return render_template('log.html',
+        result = result,
+        lines = lines,
+        page = page,
+        more = more)
 
 @app.route('/follow/<nickname>')
 @login_required
@@ -50,3 +50,102 @@ ADMINS = ['you@example.com']
 # pagination
 POSTS_PER_PAGE = 50
 MAX_SEARCH_RESULTS = 50
+
+# chef deployment scripts
+CHEF_REPO = 'c:\\Users\\sgopalak\\chef-repo'
+DEPLOY_SCRIPT = CHEF_REPO + '\\deploy.bat'
+BOOTSTRAP_SCRIPT = CHEF_REPO + '\\bootstrap.bat'
+
+# version token of the chef repository, part of the fingerprint that lets
+# group updates skip the nodes already deployed with it, such as the revision
+# of the repository. When it is empty and a rollout gives no version, every
+# node is deployed
+DEPLOY_VERSION = ''
+
+# maximum number of nodes deployed at the same time by a group update
+DEPLOY_CONCURRENCY = 8
+
+# times a node that failed to deploy is tried again by a group update, after
+# DEPLOY_RETRY_DELAY seconds, doubled at each retry up to DEPLOY_RETRY_MAX_DELAY
+DEPLOY_RETRIES = 2
+DEPLOY_RETRY_DELAY = 10
+DEPLOY_RETRY_MAX_DELAY = 120
+
+# seconds between two checks for due scheduled deploys, and seconds after
+# which a scheduled deploy that did not start counts as missed
+SCHEDULER_INTERVAL = 30
+SCHEDULE_GRACE = 300
+
+# maximum number of nodes bootstrapped at the same time by a bulk bootstrap
+BOOTSTRAP_CONCURRENCY = 4
+
+# maximum number of chef runs at the same time across all the worker
+# processes, in total and per group; DEPLOY_GROUP_LIMITS maps group names
+# to their own limit
+DEPLOY_GLOBAL_LIMIT = 16
+DEPLOY_GROUP_LIMIT = 8
+DEPLOY_GROUP_LIMITS = {}
+
+# background jobs: worker threads per process, seconds between queue polls
+# and seconds without a heartbeat before a running job is given up as dead
+JOB_WORKERS = 2
+JOB_POLL_INTERVAL = 1
+JOB_STALE_TIMEOUT = 120
+JOB_LOG_DIR = os.path.join(basedir, 'tmp', 'jobs')
+
+# command output capture: lines kept in memory from the start and the end of
+# the output, longest line kept in memory, seconds between flushes of the
+# spooled log and lines per page of the log viewer
+CAPTURE_DIR = os.path.join(basedir, 'tmp', 'logs')
+CAPTURE_HEAD_LINES = 50
+CAPTURE_TAIL_LINES = 200
+CAPTURE_MAX_LINE = 4096
+CAPTURE_FLUSH_INTERVAL = 1
+LOG_LINES_PER_PAGE = 500
+
+# seconds between two saves of the progress of a running deploy, read by the
+# other processes, and between two updates of the progress dashboard
+PROGRESS_SAVE_INTERVAL = 2
+PROGRESS_POLL_INTERVAL = 2
+
+# days of past deploys the durations of a deploy plan are estimated from
+PLAN_HISTORY = 30
+
+# nodes checked and inserted together by a bulk import, kept well below the
+# 999 bound parameters sqlite allows in a statement
+IMPORT_BATCH_SIZE = 200
+
+# node names or ids looked up per query by the bookkeeping of a deploy run,
+# below the 999 bound parameters sqlite allows in a statement
+LOOKUP_BATCH_SIZE = 500
+
+# nodes fetched per query by an inventory export
+EXPORT_WINDOW = 1000
+
+# nodes listed per group on the deploy page and per page of a group listing,
+# and the largest page of the JSON node listing
+NODES_PER_PAGE = 50
+MAX_NODES_PER_PAGE = 1000
+
+# node probes: ports that must accept a TCP connection, seconds before a
+# connection or the disk script gives up, nodes probed at the same time and
+# claimed at once by a prober, seconds a probe stays valid and between two
+# rounds of the prober. PROBE_DISK_SCRIPT prints the free megabytes of the
+# disk of the node at the ip given, left empty only reachability is probed;
+# nodes with less than PROBE_MIN_FD_SPACE megabytes free are full
+PROBE_PORTS = [22]
+PROBE_TIMEOUT = 3
+PROBE_CONCURRENCY = 32
+PROBE_BATCH = 500
+PROBE_TTL = 600
+PROBE_INTERVAL = 60
+PROBE_DISK_SCRIPT = ''
+PROBE_MIN_FD_SPACE = 1024
+
+# what a rollout does with the nodes a valid probe found unreachable or full:
+# 'skip' them, deploy them 'last' in their group, or 'deploy' them as usual
+PROBE_UNHEALTHY = 'last'
+
+# items per page of the lists of the JSON API, by default and at most
+API_PAGE_SIZE = 100
+MAX_API_PAGE_SIZE = 1000
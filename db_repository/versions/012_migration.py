@@ -0,0 +1,37 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+job = Table('job', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('command', String(length=1024)),
+    Column('timeout', Integer),
+    Column('status', SmallInteger, index=True, default=ColumnDefault(0)),
+    Column('exit_code', Integer),
+    Column('output', Text),
+    Column('error', Text),
+    Column('worker', String(length=140)),
+    Column('timestamp', DateTime),
+    Column('started', DateTime),
+    Column('heartbeat', DateTime),
+    Column('finished', DateTime),
+    Column('user_id', Integer),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['job'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['job'].drop()
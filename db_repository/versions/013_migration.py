@@ -0,0 +1,51 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+deploy_run = Table('deploy_run', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('strategy', String(length=140)),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('duration', Float),
+    Column('grp_id', Integer),
+    Column('user_id', Integer),
+)
+Index('ix_deploy_run_grp_started', deploy_run.c.grp_id, deploy_run.c.started_at)
+
+node_deploy_result = Table('node_deploy_result', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('run_id', Integer, index=True),
+    Column('node_id', Integer),
+    Column('grp_id', Integer),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('duration', Float),
+    Column('exit_status', Integer),
+    Column('output', Text),
+    Column('error', Text),
+    Column('log', String(length=255)),
+)
+Index('ix_node_deploy_result_node_started', node_deploy_result.c.node_id, node_deploy_result.c.started_at)
+Index('ix_node_deploy_result_grp_started', node_deploy_result.c.grp_id, node_deploy_result.c.started_at)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_run'].create()
+    post_meta.tables['node_deploy_result'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_run'].drop()
+    post_meta.tables['node_deploy_result'].drop()
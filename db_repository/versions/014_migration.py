@@ -0,0 +1,37 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+deploy_run = Table('deploy_run', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('strategy', String(length=140)),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('duration', Float),
+    Column('org_id', Integer),
+    Column('env_id', Integer),
+    Column('grp_id', Integer),
+    Column('user_id', Integer),
+)
+Index('ix_deploy_run_grp_started', deploy_run.c.grp_id, deploy_run.c.started_at)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_run'].columns['org_id'].create()
+    post_meta.tables['deploy_run'].columns['env_id'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_run'].columns['org_id'].drop()
+    post_meta.tables['deploy_run'].columns['env_id'].drop()
@@ -0,0 +1,61 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+job = Table('job', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('command', String(length=1024)),
+    Column('timeout', Integer),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('exit_code', Integer),
+    Column('output', Text),
+    Column('error', Text),
+    Column('log', String(length=255)),
+    Column('inflight_key', String(length=255)),
+    Column('worker', String(length=140)),
+    Column('timestamp', DateTime),
+    Column('started', DateTime),
+    Column('heartbeat', DateTime),
+    Column('finished', DateTime),
+    Column('user_id', Integer),
+)
+Index('ix_job_status', job.c.status)
+
+deploy_run = Table('deploy_run', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('strategy', String(length=140)),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('inflight_key', String(length=255)),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('duration', Float),
+    Column('org_id', Integer),
+    Column('env_id', Integer),
+    Column('grp_id', Integer),
+    Column('user_id', Integer),
+)
+Index('ix_deploy_run_grp_started', deploy_run.c.grp_id, deploy_run.c.started_at)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['job'].columns['log'].create()
+    post_meta.tables['job'].columns['inflight_key'].create()
+    Index('ix_job_inflight_key', job.c.inflight_key, unique=True).create()
+    post_meta.tables['deploy_run'].columns['inflight_key'].create()
+    Index('ix_deploy_run_inflight_key', deploy_run.c.inflight_key, unique=True).create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['job'].columns['log'].drop()
+    post_meta.tables['job'].columns['inflight_key'].drop()
+    post_meta.tables['deploy_run'].columns['inflight_key'].drop()
@@ -0,0 +1,53 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+job = Table('job', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('command', String(length=1024)),
+    Column('timeout', Integer),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('exit_code', Integer),
+    Column('output', Text),
+    Column('error', Text),
+    Column('log', String(length=255)),
+    Column('inflight_key', String(length=255)),
+    Column('grp_name', String(length=140)),
+    Column('worker', String(length=140)),
+    Column('timestamp', DateTime),
+    Column('started', DateTime),
+    Column('heartbeat', DateTime),
+    Column('finished', DateTime),
+    Column('user_id', Integer),
+)
+Index('ix_job_status', job.c.status)
+Index('ix_job_inflight_key', job.c.inflight_key, unique=True)
+
+deploy_slot = Table('deploy_slot', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('scope', String(length=140)),
+    Column('slot', Integer),
+    Column('job_id', Integer, index=True),
+    Column('timestamp', DateTime),
+)
+Index('ix_deploy_slot_scope_slot', deploy_slot.c.scope, deploy_slot.c.slot, unique=True)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['job'].columns['grp_name'].create()
+    post_meta.tables['deploy_slot'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['job'].columns['grp_name'].drop()
+    post_meta.tables['deploy_slot'].drop()
@@ -0,0 +1,49 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+job = Table('job', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('command', String(length=1024)),
+    Column('timeout', Integer),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('exit_code', Integer),
+    Column('output', Text),
+    Column('error', Text),
+    Column('log', String(length=255)),
+    Column('wall_time', Float),
+    Column('cpu_time', Float),
+    Column('max_rss', Integer),
+    Column('inflight_key', String(length=255)),
+    Column('grp_name', String(length=140)),
+    Column('worker', String(length=140)),
+    Column('timestamp', DateTime),
+    Column('started', DateTime),
+    Column('heartbeat', DateTime),
+    Column('finished', DateTime),
+    Column('user_id', Integer),
+)
+Index('ix_job_status', job.c.status)
+Index('ix_job_inflight_key', job.c.inflight_key, unique=True)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['job'].columns['wall_time'].create()
+    post_meta.tables['job'].columns['cpu_time'].create()
+    post_meta.tables['job'].columns['max_rss'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['job'].columns['wall_time'].drop()
+    post_meta.tables['job'].columns['cpu_time'].drop()
+    post_meta.tables['job'].columns['max_rss'].drop()
@@ -0,0 +1,54 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+node = Table('node', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String(length=140)),
+    Column('fd_space', Integer),
+    Column('timestamp', DateTime),
+    Column('ip', String(length=45)),
+    Column('fingerprint', String(length=40)),
+    Column('grp_id', Integer),
+)
+
+deploy_run = Table('deploy_run', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('strategy', String(length=140)),
+    Column('version', String(length=140)),
+    Column('unchanged', Integer, default=ColumnDefault(0)),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('inflight_key', String(length=255)),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('duration', Float),
+    Column('org_id', Integer),
+    Column('env_id', Integer),
+    Column('grp_id', Integer),
+    Column('user_id', Integer),
+)
+Index('ix_deploy_run_grp_started', deploy_run.c.grp_id, deploy_run.c.started_at)
+Index('ix_deploy_run_inflight_key', deploy_run.c.inflight_key, unique=True)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['node'].columns['fingerprint'].create()
+    post_meta.tables['deploy_run'].columns['version'].create()
+    post_meta.tables['deploy_run'].columns['unchanged'].create(populate_default=False)
+    migrate_engine.execute(deploy_run.update().values(unchanged=0))
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['node'].columns['fingerprint'].drop()
+    post_meta.tables['deploy_run'].columns['version'].drop()
+    post_meta.tables['deploy_run'].columns['unchanged'].drop()
@@ -0,0 +1,39 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+node = Table('node', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String(length=140)),
+    Column('fd_space', Integer),
+    Column('timestamp', DateTime),
+    Column('ip', String(length=45)),
+    Column('fingerprint', String(length=40)),
+    Column('bootstrap_status', SmallInteger, default=ColumnDefault(0)),
+    Column('bootstrapped_at', DateTime),
+    Column('bootstrap_job_id', Integer),
+    Column('grp_id', Integer),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['node'].columns['bootstrap_status'].create(populate_default=False)
+    post_meta.tables['node'].columns['bootstrapped_at'].create()
+    post_meta.tables['node'].columns['bootstrap_job_id'].create()
+    migrate_engine.execute(node.update().values(bootstrap_status=0))
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['node'].columns['bootstrap_status'].drop()
+    post_meta.tables['node'].columns['bootstrapped_at'].drop()
+    post_meta.tables['node'].columns['bootstrap_job_id'].drop()
@@ -0,0 +1,71 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+deploy_run = Table('deploy_run', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('strategy', String(length=140)),
+    Column('version', String(length=140)),
+    Column('unchanged', Integer, default=ColumnDefault(0)),
+    Column('succeeded', Integer, default=ColumnDefault(0)),
+    Column('failed', Integer, default=ColumnDefault(0)),
+    Column('skipped', Integer, default=ColumnDefault(0)),
+    Column('retried', Integer, default=ColumnDefault(0)),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('inflight_key', String(length=255)),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('duration', Float),
+    Column('org_id', Integer),
+    Column('env_id', Integer),
+    Column('grp_id', Integer),
+    Column('user_id', Integer),
+)
+Index('ix_deploy_run_grp_started', deploy_run.c.grp_id, deploy_run.c.started_at)
+Index('ix_deploy_run_inflight_key', deploy_run.c.inflight_key, unique=True)
+
+node_deploy_result = Table('node_deploy_result', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('run_id', Integer),
+    Column('node_id', Integer),
+    Column('grp_id', Integer),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('duration', Float),
+    Column('exit_status', Integer),
+    Column('attempts', Integer, default=ColumnDefault(1)),
+    Column('output', Text),
+    Column('error', Text),
+    Column('log', String(length=255)),
+)
+Index('ix_node_deploy_result_grp_started', node_deploy_result.c.grp_id, node_deploy_result.c.started_at)
+Index('ix_node_deploy_result_node_started', node_deploy_result.c.node_id, node_deploy_result.c.started_at)
+Index('ix_node_deploy_result_run_id', node_deploy_result.c.run_id)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_run'].columns['succeeded'].create(populate_default=False)
+    post_meta.tables['deploy_run'].columns['failed'].create(populate_default=False)
+    post_meta.tables['deploy_run'].columns['skipped'].create(populate_default=False)
+    post_meta.tables['deploy_run'].columns['retried'].create(populate_default=False)
+    post_meta.tables['node_deploy_result'].columns['attempts'].create(populate_default=False)
+    migrate_engine.execute(deploy_run.update().values(succeeded=0, failed=0, skipped=0, retried=0))
+    migrate_engine.execute(node_deploy_result.update().values(attempts=1))
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_run'].columns['succeeded'].drop()
+    post_meta.tables['deploy_run'].columns['failed'].drop()
+    post_meta.tables['deploy_run'].columns['skipped'].drop()
+    post_meta.tables['deploy_run'].columns['retried'].drop()
+    post_meta.tables['node_deploy_result'].columns['attempts'].drop()
@@ -0,0 +1,44 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+deploy_run = Table('deploy_run', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('strategy', String(length=140)),
+    Column('version', String(length=140)),
+    Column('unchanged', Integer, default=ColumnDefault(0)),
+    Column('succeeded', Integer, default=ColumnDefault(0)),
+    Column('failed', Integer, default=ColumnDefault(0)),
+    Column('skipped', Integer, default=ColumnDefault(0)),
+    Column('retried', Integer, default=ColumnDefault(0)),
+    Column('progress', Text),
+    Column('status', SmallInteger, default=ColumnDefault(0)),
+    Column('inflight_key', String(length=255)),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('duration', Float),
+    Column('org_id', Integer),
+    Column('env_id', Integer),
+    Column('grp_id', Integer),
+    Column('user_id', Integer),
+)
+Index('ix_deploy_run_grp_started', deploy_run.c.grp_id, deploy_run.c.started_at)
+Index('ix_deploy_run_inflight_key', deploy_run.c.inflight_key, unique=True)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_run'].columns['progress'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_run'].columns['progress'].drop()
@@ -0,0 +1,61 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+organization = Table('organization', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String(length=140)),
+    Column('timestamp', DateTime),
+    Column('user_id', Integer),
+)
+
+env = Table('env', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String(length=140)),
+    Column('timestamp', DateTime),
+    Column('org_id', Integer),
+)
+
+group = Table('group', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String(length=140)),
+    Column('timestamp', DateTime),
+    Column('env_id', Integer),
+)
+
+node = Table('node', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String(length=140)),
+    Column('fd_space', Integer),
+    Column('timestamp', DateTime),
+    Column('ip', String(length=45)),
+    Column('fingerprint', String(length=40)),
+    Column('bootstrap_status', SmallInteger, default=ColumnDefault(0)),
+    Column('bootstrapped_at', DateTime),
+    Column('bootstrap_job_id', Integer),
+    Column('grp_id', Integer),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    Index('ix_organization_user_name', organization.c.user_id, organization.c.name).create()
+    Index('ix_env_org_name', env.c.org_id, env.c.name).create()
+    Index('ix_group_env_name', group.c.env_id, group.c.name).create()
+    Index('ix_node_grp_name', node.c.grp_id, node.c.name).create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    Index('ix_organization_user_name', organization.c.user_id, organization.c.name).drop()
+    Index('ix_env_org_name', env.c.org_id, env.c.name).drop()
+    Index('ix_group_env_name', group.c.env_id, group.c.name).drop()
+    Index('ix_node_grp_name', node.c.grp_id, node.c.name).drop()
@@ -0,0 +1,31 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+organization = Table('organization', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String(length=140)),
+    Column('timestamp', DateTime),
+    Column('tree_version', Integer, default=ColumnDefault(0)),
+    Column('user_id', Integer),
+)
+Index('ix_organization_user_name', organization.c.user_id, organization.c.name)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['organization'].columns['tree_version'].create(populate_default=False)
+    migrate_engine.execute(organization.update().values(tree_version=0))
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['organization'].columns['tree_version'].drop()
@@ -0,0 +1,44 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+node = Table('node', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', String(length=140)),
+    Column('fd_space', Integer),
+    Column('timestamp', DateTime),
+    Column('ip', String(length=45)),
+    Column('fingerprint', String(length=40)),
+    Column('bootstrap_status', SmallInteger, default=ColumnDefault(0)),
+    Column('bootstrapped_at', DateTime),
+    Column('bootstrap_job_id', Integer),
+    # no CHECK constraint, the SQLite downgrade rebuilds the table without the column
+    Column('reachable', Boolean(create_constraint=False)),
+    Column('probed_at', DateTime),
+    Column('probe_error', String(length=255)),
+    Column('grp_id', Integer),
+)
+Index('ix_node_grp_name', node.c.grp_id, node.c.name)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['node'].columns['reachable'].create()
+    post_meta.tables['node'].columns['probed_at'].create()
+    post_meta.tables['node'].columns['probe_error'].create()
+    Index('ix_node_probed_at', node.c.probed_at).create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['node'].columns['reachable'].drop()
+    post_meta.tables['node'].columns['probed_at'].drop()
+    post_meta.tables['node'].columns['probe_error'].drop()
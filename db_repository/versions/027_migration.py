@@ -0,0 +1,47 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+deploy_schedule = Table('deploy_schedule', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('cron', String(length=140)),
+    Column('run_at', DateTime),
+    Column('catch_up', SmallInteger, default=ColumnDefault(0)),
+    Column('enabled', Boolean, default=ColumnDefault(True)),
+    Column('strategy', String(length=140)),
+    Column('size', Integer),
+    Column('max_failures', Integer, default=ColumnDefault(0)),
+    Column('order', String(length=255)),
+    Column('version', String(length=140)),
+    # no CHECK constraint, the SQLite downgrade rebuilds the table without the column
+    Column('force', Boolean(create_constraint=False), default=ColumnDefault(False)),
+    Column('last_run_at', DateTime),
+    Column('last_run_id', Integer),
+    Column('timestamp', DateTime),
+    Column('org_id', Integer),
+    Column('env_id', Integer),
+    Column('grp_id', Integer),
+    Column('user_id', Integer),
+)
+Index('ix_deploy_schedule_enabled_run_at', deploy_schedule.c.enabled, deploy_schedule.c.run_at)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_schedule'].columns['version'].create()
+    post_meta.tables['deploy_schedule'].columns['force'].create(populate_default=False)
+    migrate_engine.execute(deploy_schedule.update().values(force=False))
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['deploy_schedule'].columns['version'].drop()
+    post_meta.tables['deploy_schedule'].columns['force'].drop()
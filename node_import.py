@@ -0,0 +1,20 @@
+#!flask/bin/python
+import sys
+from app.models import User
+from app.hierarchy import resolve_path
+from app.inventory import parse_nodes, import_nodes
+if len(sys.argv) != 5:
+    print "usage: node_import.py <nickname> <organization> <environment> <file.csv|file.json>"
+    sys.exit(1)
+nickname, org_name, env_name, filename = sys.argv[1:]
+user = User.query.filter_by(nickname = nickname).first()
+path = resolve_path(user, org_name, env_name) if user else None
+if path is None:
+    print "no environment " + env_name + " in organization " + org_name + " of " + nickname
+    sys.exit(1)
+rows = parse_nodes(open(filename).read(), 'json' if filename.lower().endswith('.json') else 'csv')
+imported, errors = import_nodes(path.org, path.env, rows)
+for number, error in errors:
+    print "row %d: %s" % (number, error)
+print "%d nodes imported, %d rows rejected" % (imported, len(errors))
+sys.exit(1 if errors else 0)
@@ -6,13 +6,36 @@ cov = coverage(branch = True, omit = ['flask/*', 'tests.py'])
 cov.start()
 
 import os
+import json
+import time
+import threading
 import unittest
 from datetime import datetime, timedelta
 
+from flask import g
 from config import basedir
 from app import app, db
-from app.models import User, Post, MCSetting
+from app.models import User, Post, MCSetting, Job, JOB_QUEUED, JOB_RUNNING, Organization, Env, Group, Node, NodeDeployResult, RUN_FAILED, BOOTSTRAP_DONE, BOOTSTRAP_FAILED, \
+    RUN_SUCCEEDED, RUN_HALTED, DeploySchedule, CATCH_UP_SKIP, CATCH_UP_ONCE
 from app.translate import microsoft_translate
+from app.executor import DeployExecutor, summarize, skipped_result
+from app.jobs import claim, insert_job, start_job, finish_job
+from app.run import Command
+from app.capture import OutputCapture, LogReader
+from app.strategies import make_strategy, RetryPolicy
+from app.history import start_run, finish_run
+from app.hierarchy import group_targets, make_stages, load_tree, resolve_path, cached_tree, bump_tree_version, \
+    group_counts, first_nodes, node_page
+from app.limits import acquire, release, release_stale, queue_depth
+from app.bootstrap import pending_bootstrap, bootstrap_node, bootstrap_key
+from app.cron import CronSchedule
+from app.scheduler import claim_due
+from app.plan import deploy_plan, batch_estimate
+from app.progress import RunProgress, percentile
+from app.api import node_rows, parse_fields, etag_response, NODE_FIELDS
+from app.probe import ProbeResult, save_probes, claim_stale, node_problems, triage
+from app.labels import parse_selector, format_selector, set_labels
+from app.inventory import parse_nodes, import_nodes, export_nodes, export_lines
 
 class TestCase(unittest.TestCase):
     def setUp(self):
@@ -193,6 +216,509 @@ class TestCase(unittest.TestCase):
         assert mc4[0] == c4
         assert mc1[0] != c2
 
+    def test_deploy_executor(self):
+        lock = threading.Lock()
+        running = [0, 0]
+        def deploy(node_name, grp_name, log_path):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[0], running[1])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            if node_name == 'n3':
+                raise Exception('ssh failure')
+            return 0, node_name + ' deployed', ''
+        targets = [('n%d' % i, 'web') for i in range(10)]
+        results = DeployExecutor(concurrency = 4, deploy = deploy).run(targets)
+        assert len(results) == 10
+        assert [r.node_name for r in results] == [t[0] for t in targets]
+        assert running[1] <= 4
+        assert results[0].ok and results[0].output == 'n0 deployed'
+        assert not results[3].ok
+        assert results[3].status == -1
+        assert 'ssh failure' in results[3].error
+
+    def test_job_claim(self):
+        utcnow = datetime.utcnow()
+        j1 = Job(command = 'echo 1', status = JOB_QUEUED, timestamp = utcnow)
+        j2 = Job(command = 'echo 2', status = JOB_QUEUED, timestamp = utcnow)
+        db.session.add(j1)
+        db.session.add(j2)
+        db.session.commit()
+        job = claim()
+        assert job.id == j1.id
+        assert job.status == JOB_RUNNING
+        assert job.worker is not None
+        assert job.to_dict()['status'] == 'running'
+        assert claim().id == j2.id
+        assert claim() == None
+
+    def test_command_output_handler(self):
+        lines = []
+        status, output, error = Command(['sh', '-c', 'echo one; echo two >&2; echo three']).run(output_handler = lines.append)
+        assert status == 0
+        assert output == ''
+        assert lines == ['one\n', 'two\n', 'three\n']
+
+    def test_output_capture(self):
+        path = os.path.join(basedir, 'tmp', 'test_capture.log.gz')
+        capture = OutputCapture(path, head_lines = 2, tail_lines = 3)
+        for i in range(100):
+            capture('line %d\n' % i)
+        capture.close()
+        summary = capture.summary()
+        assert summary.startswith('line 0\nline 1\n')
+        assert '95 lines skipped' in summary
+        assert summary.endswith('line 97\nline 98\nline 99\n')
+        reader = LogReader(path)
+        assert len(list(reader.lines())) == 100
+        lines, more = reader.page(2, 10)
+        assert lines[0] == 'line 10\n' and len(lines) == 10 and more
+        lines, more = reader.page(10, 10)
+        assert lines[-1] == 'line 99\n' and not more
+        os.remove(path)
+
+    def test_deploy_strategies(self):
+        targets = [('n%d' % i, 'web') for i in range(10)]
+        assert [len(b) for b in make_strategy('all').batches(targets)] == [10]
+        assert [len(b) for b in make_strategy('canary', 2).batches(targets)] == [2, 8]
+        assert [len(b) for b in make_strategy('rolling', 4).batches(targets)] == [4, 4, 2]
+        assert [len(b) for b in make_strategy('percent', 25).batches(targets)] == [3, 3, 3, 1]
+        deployed = []
+        def deploy(node_name, grp_name, log_path):
+            deployed.append(node_name)
+            if node_name in ('n1', 'n4'):
+                return 1, '', 'chef failure'
+            return 0, '', ''
+        executor = DeployExecutor(concurrency = 2, deploy = deploy)
+        results = executor.run(targets, make_strategy('canary', 1))
+        assert len(deployed) == 10
+        assert len([r for r in results if not r.ok]) == 2
+        del deployed[:]
+        results = executor.run(targets, make_strategy('rolling', 3, max_failures = 1))
+        assert sorted(deployed) == ['n%d' % i for i in range(6)]
+        assert [r.node_name for r in results] == [t[0] for t in targets]
+        assert [r.skipped for r in results] == [False] * 6 + [True] * 4
+
+    def test_deploy_retries(self):
+        policy = RetryPolicy(retries = 2, delay = 10, max_delay = 15, jitter = 0.5)
+        assert policy.should_retry(2) and not policy.should_retry(3)
+        assert 5 <= policy.backoff(1) <= 10
+        assert 7.5 <= policy.backoff(3) <= 15
+        lock = threading.Lock()
+        calls = []
+        def deploy(node_name, grp_name, log_path):
+            with lock:
+                calls.append(node_name)
+                failures = calls.count(node_name)
+            if node_name == 'n0' and failures < 3:
+                return 1, '', 'transient failure'
+            if node_name == 'n1':
+                return 1, '', 'chef failure'
+            time.sleep(0.02)
+            return 0, '', ''
+        targets = [('n%d' % i, 'web') for i in range(4)]
+        executor = DeployExecutor(concurrency = 2, deploy = deploy, retry = RetryPolicy(retries = 2, delay = 0.05))
+        results = executor.run(targets)
+        assert calls.count('n0') == 3 and calls.count('n1') == 3
+        # the healthy nodes are not held back by the retries
+        assert calls.index('n3') < len(calls) - 2
+        assert results[0].ok and results[0].attempts == 3
+        assert not results[1].ok and results[1].attempts == 3
+        assert results[2].attempts == 1
+        assert summarize(results) == {'succeeded': 3, 'failed': 1, 'skipped': 0, 'retried': 2}
+
+    def test_run_progress(self):
+        assert percentile([1, 2, 3, 4], 50) == 2
+        assert percentile(range(1, 101), 95) == 95
+        assert percentile([], 50) is None
+        saved = []
+        progress = RunProgress(6, saved.append)
+        def deploy(node_name, grp_name, log_path):
+            snapshot = progress.snapshot()
+            assert snapshot['running'] >= 1
+            return (1 if node_name == 'n1' else 0), '', ''
+        executor = DeployExecutor(concurrency = 2, deploy = deploy, progress = progress)
+        executor.run([('n%d' % i, 'web') for i in range(6)], make_strategy('rolling', 2))
+        snapshot = progress.snapshot()
+        assert (snapshot['queued'], snapshot['running']) == (0, 0)
+        assert (snapshot['succeeded'], snapshot['failed'], snapshot['skipped']) == (1, 1, 4)
+        assert snapshot['p50'] is not None and snapshot['eta'] == 0
+        assert len(saved) == 1
+
+    def add_org(self):
+        u = User(nickname = 'john', email = 'john@example.com')
+        org = Organization(name = 'acme', user = u)
+        env = Env(name = 'prod', org = org)
+        web = Group(name = 'web', env = env)
+        db_grp = Group(name = 'db', env = env)
+        nodes = [Node(name = 'web%d' % i, ip = '10.0.0.%d' % i, grp = web) for i in range(3)]
+        nodes.append(Node(name = 'db0', ip = '10.0.1.0', grp = db_grp))
+        db.session.add_all([u, org, env, web, db_grp] + nodes)
+        db.session.commit()
+        return org, web, db_grp
+
+    def test_deploy_history(self):
+        org, web, db_grp = self.add_org()
+        def deploy(node_name, grp_name, log_path):
+            return (1 if node_name == 'web2' else 0), 'done', ''
+        executor = DeployExecutor(deploy = deploy)
+        first, created = start_run(grp = web, strategy = 'all')
+        finish_run(first, executor.run_group(web))
+        time.sleep(0.01)
+        second, created = start_run(grp = web, strategy = 'all')
+        finish_run(second, executor.run_group(web))
+        other, created = start_run(grp = db_grp)
+        finish_run(other, executor.run_group(db_grp))
+        assert second.status == RUN_FAILED
+        assert second.results.count() == 3
+        assert second.duration is not None
+        last = org.last_node_results().all()
+        assert len(last) == 4
+        assert set(r.run_id for r in last) == set([second.id, other.id])
+        assert [r.node.name for r in last if not r.is_ok()] == ['web2']
+
+    def test_rollout_stages(self):
+        org, web, db_grp = self.add_org()
+        groups, unchanged = group_targets(org)
+        assert unchanged == 0
+        assert groups.keys() == ['web', 'db']
+        assert groups['web'] == [('web0', 'web'), ('web1', 'web'), ('web2', 'web')]
+        stages = make_stages(groups, 'db > web')
+        assert stages == [[groups['db']], [groups['web']]]
+        assert make_stages(groups) == [[groups['web'], groups['db']]]
+        deployed = []
+        def deploy(node_name, grp_name, log_path):
+            deployed.append(node_name)
+            return (1 if grp_name == 'db' else 0), '', ''
+        results = DeployExecutor(deploy = deploy).run_stages(stages)
+        assert deployed == ['db0']
+        assert [r.node_name for r in results] == ['db0', 'web0', 'web1', 'web2']
+        assert [r.skipped for r in results] == [False, True, True, True]
+
+    def test_load_tree(self):
+        org, web, db_grp = self.add_org()
+        staging = Env(name = 'staging', org = org)
+        db.session.add(staging)
+        db.session.add(Group(name = 'empty', env = staging))
+        db.session.commit()
+        tree = load_tree(org)
+        assert [env.name for env, groups in tree] == ['prod', 'staging']
+        prod_groups = tree[0].groups
+        assert [grp.name for grp, nodes, counts in prod_groups] == ['web', 'db']
+        assert prod_groups[0].counts == (3, 0)
+        assert [node.name for node in prod_groups[0].nodes] == ['web0', 'web1', 'web2']
+        assert [node.name for node in prod_groups[1].nodes] == ['db0']
+        assert tree[1].groups[0].grp.name == 'empty' and tree[1].groups[0].nodes == []
+
+    def test_node_pages(self):
+        org, web, db_grp = self.add_org()
+        Node.query.filter_by(name = 'web1').update({'bootstrap_status': BOOTSTRAP_DONE})
+        db.session.commit()
+        assert [node.name for node in first_nodes(org, 2)] == ['web0', 'web1', 'db0']
+        assert group_counts(org) == {web.id: (3, 1), db_grp.id: (1, 0)}
+        assert group_counts(org, grp = db_grp) == {db_grp.id: (1, 0)}
+        nodes, after = node_page(web, size = 2)
+        assert [node.name for node in nodes] == ['web0', 'web1'] and after == 'web1'
+        nodes, after = node_page(web, after, size = 2)
+        assert [node.name for node in nodes] == ['web2'] and after is None
+        nodes, after = node_page(web, size = 3)
+        assert len(nodes) == 3 and after is None
+
+    def test_cached_tree(self):
+        org, web, db_grp = self.add_org()
+        tree = cached_tree(org)
+        assert cached_tree(org) is tree
+        assert [node.name for node in tree[0].groups[0].nodes] == ['web0', 'web1', 'web2']
+        db.session.add(Node(name = 'web3', ip = '10.0.0.3', grp = web))
+        bump_tree_version(org.id)
+        db.session.commit()
+        tree = cached_tree(org)
+        assert cached_tree(org) is tree
+        assert [node.name for node in tree[0].groups[0].nodes] == ['web0', 'web1', 'web2', 'web3']
+
+    def test_import_nodes(self):
+        org, web, db_grp = self.add_org()
+        staging = Env(name = 'staging', org = org)
+        db.session.add_all([staging, Group(name = 'qa', env = staging)])
+        db.session.commit()
+        rows = parse_nodes('name,ip,group\n'
+            'web3,10.0.0.3,web\n'
+            'web0,10.0.0.9,web\n'
+            'web4,10.0.0.1,web\n'
+            'cache0,10.0.2.0,cache\n'
+            'web3,10.0.0.4,web\n'
+            'web5,,web\n'
+            'qa0,10.0.3.0,qa\n')
+        imported, errors = import_nodes(org, web.env, rows)
+        assert imported == 2
+        assert [number for number, error in errors] == [2, 3, 5, 6, 7]
+        assert [node.name for node in web.nodes.order_by(Node.id)] == ['web0', 'web1', 'web2', 'web3']
+        assert Group.query.filter_by(name = 'cache').one().nodes.one().ip == '10.0.2.0'
+        assert org.tree_version > 0
+        rows = parse_nodes('[{"name": "db1", "ip": "10.0.1.1", "group": "db"}]', 'json')
+        assert import_nodes(org, web.env, rows) == (1, [])
+        assert db_grp.nodes.count() == 2
+        self.assertRaises(ValueError, parse_nodes, '{"name": "db2"}', 'json')
+
+    def test_export_nodes(self):
+        org, web, db_grp = self.add_org()
+        nodes = list(export_nodes(org, window = 3))
+        assert [node['name'] for node in nodes] == ['web0', 'web1', 'web2', 'db0']
+        assert nodes[3] == {'env': 'prod', 'group': 'db', 'name': 'db0', 'ip': '10.0.1.0',
+            'bootstrap': 'not bootstrapped', 'fingerprint': None}
+        assert [node['name'] for node in export_nodes(org, grp = db_grp, window = 1)] == ['db0']
+        lines = list(export_lines(nodes, 'csv'))
+        assert lines[0] == 'env,group,name,ip,bootstrap,fingerprint\r\n'
+        assert lines[4] == 'prod,db,db0,10.0.1.0,not bootstrapped,\r\n'
+        assert parse_nodes(''.join(lines))[3] == {'name': 'db0', 'ip': '10.0.1.0', 'group': 'db', 'labels': ''}
+        assert len(list(export_lines(nodes, 'jsonl'))) == 4
+        chef = json.loads(''.join(export_lines(nodes, 'chef')))
+        assert chef[0]['run_list'] == ['role[web]'] and chef[0]['automatic']['ipaddress'] == '10.0.0.0'
+        assert json.loads(''.join(export_lines([], 'chef'))) == []
+
+    def test_label_selectors(self):
+        org, web, db_grp = self.add_org()
+        ids = dict(db.session.query(Node.name, Node.id))
+        set_labels({
+            ids['web0']: {'role': 'web', 'dc': 'east'},
+            ids['web1']: {'role': 'web', 'dc': 'west'},
+            ids['web2']: {'role': 'web'},
+            ids['db0']: {'role': 'db', 'dc': 'east'} })
+        db.session.commit()
+        def selected(selector):
+            groups, unchanged = group_targets(org, selector = selector)
+            return [node_name for targets in groups.values() for node_name, grp_name in targets]
+        assert selected('role=web,dc!=east') == ['web1', 'web2']
+        assert selected('dc in (east, west)') == ['web0', 'web1', 'db0']
+        assert selected('role notin (web),dc') == ['db0']
+        assert selected('!dc') == ['web2']
+        assert selected('') == ['web0', 'web1', 'web2', 'db0']
+        assert format_selector(parse_selector(' role == web , !canary')) == 'role=web,!canary'
+        self.assertRaises(ValueError, parse_selector, 'role=web dc=east')
+        rows = parse_nodes('[{"name": "web3", "ip": "10.0.0.3", "group": "web", "labels": {"role": "web", "dc": "west"}}]', 'json')
+        assert import_nodes(org, web.env, rows) == (1, [])
+        assert selected('dc=west') == ['web1', 'web3']
+
+    def test_node_probes(self):
+        org, web, db_grp = self.add_org()
+        now = datetime.utcnow()
+        assert sorted(node_name for node_name, ip in claim_stale(now)) == ['db0', 'web0', 'web1', 'web2']
+        assert claim_stale(now) == []
+        results = [
+            ProbeResult('web0', False, None, 'port 22: timed out'),
+            ProbeResult('web1', True, 10, None),
+            ProbeResult('web2', True, 50000, None)]
+        node_ids = dict((node.name, node.id) for node in Node.query)
+        assert sorted(save_probes(results)) == sorted(node_ids[name] for name in ('web0', 'web1', 'web2'))
+        db.session.commit()
+        # only the nodes whose outcome changed are reported
+        assert save_probes(results[:2] + [ProbeResult('web2', True, 40000, None)]) == [node_ids['web2']]
+        db.session.commit()
+        problems = node_problems(org)
+        assert sorted(problems) == ['web0', 'web1']
+        assert node_problems(org, grp = db_grp) == {}
+        assert node_problems(org, now = now + timedelta(days = 1)) == {}
+        stages = [[[('web0', 'web'), ('web1', 'web'), ('web2', 'web')], [('db0', 'db')]]]
+        assert triage(stages, problems, 'last') == ([[[('web2', 'web'), ('web0', 'web'), ('web1', 'web')], [('db0', 'db')]]], [])
+        triaged, skipped = triage(stages, problems, 'skip')
+        assert triaged == [[[('web2', 'web')], [('db0', 'db')]]]
+        assert [node_name for node_name, grp_name, problem in skipped] == ['web0', 'web1']
+        assert triage(stages, problems, 'deploy') == (stages, [])
+        run, created = start_run(grp = web)
+        finish_run(run, [skipped_result('web0', 'web', 'Skipped, the node is unreachable.')])
+        assert run.status == RUN_SUCCEEDED
+        run, created = start_run(grp = web)
+        finish_run(run, [skipped_result('web0', 'web')])
+        assert run.status == RUN_HALTED
+
+    def test_api_nodes(self):
+        org, web, db_grp = self.add_org()
+        nodes, cursor = node_rows(org, fields = ['name', 'group'], limit = 3)
+        assert nodes == [{'name': 'web%d' % i, 'group': 'web'} for i in range(3)]
+        assert cursor == Node.query.filter_by(name = 'web2').one().id
+        nodes, cursor = node_rows(org, fields = ['name'], cursor = cursor, limit = 3)
+        assert nodes == [{'name': 'db0'}] and cursor is None
+        nodes, cursor = node_rows(org, grp = db_grp)
+        assert nodes[0]['env'] == 'prod' and nodes[0]['bootstrap'] == 'not bootstrapped' and nodes[0]['labels'] == {}
+        assert parse_fields('ip, name', NODE_FIELDS) == ['name', 'ip']
+        self.assertRaises(ValueError, parse_fields, 'name,password', NODE_FIELDS)
+        built = []
+        def build():
+            built.append(True)
+            return {'nodes': []}
+        with app.test_request_context('/api/v1/orgs/acme/nodes'):
+            g.user = org.user
+            etag = etag_response(1, build).headers['ETag']
+        with app.test_request_context('/api/v1/orgs/acme/nodes', headers = {'If-None-Match': etag}):
+            g.user = org.user
+            assert etag_response(1, build).status_code == 304
+            assert etag_response(2, build).status_code == 200
+        assert len(built) == 2
+
+    def test_resolve_path(self):
+        org, web, db_grp = self.add_org()
+        other = User(nickname = 'susan', email = 'susan@example.com')
+        db.session.add(other)
+        db.session.commit()
+        path = resolve_path(org.user, 'acme', 'prod', 'web', 'web1')
+        assert path.org == org and path.env == web.env and path.grp == web
+        assert path.node.name == 'web1'
+        assert resolve_path(org.user, 'acme', 'prod') == (org, web.env, None, None)
+        assert resolve_path(org.user, 'acme') == (org, None, None, None)
+        assert resolve_path(org.user, 'acme', 'prod', 'db', 'web1') is None
+        assert resolve_path(org.user, 'acme', 'staging') is None
+        assert resolve_path(other, 'acme') is None
+
+    def test_fingerprints(self):
+        org, web, db_grp = self.add_org()
+        def deploy(node_name, grp_name, log_path):
+            return (1 if node_name == 'web2' else 0), '', ''
+        run, created = start_run(grp = web, version = 'v1')
+        finish_run(run, DeployExecutor(deploy = deploy).run_group(web))
+        groups, unchanged = group_targets(org, grp = web, version = 'v1')
+        assert unchanged == 2
+        assert groups['web'] == [('web2', 'web')]
+        groups, unchanged = group_targets(org, grp = web, version = 'v2')
+        assert unchanged == 0
+        assert len(groups['web']) == 3
+        groups, unchanged = group_targets(org, grp = web, version = '')
+        assert unchanged == 0
+        node = Node.query.filter_by(name = 'web0').first()
+        node.ip = '10.0.0.99'
+        db.session.add(node)
+        db.session.commit()
+        groups, unchanged = group_targets(org, grp = web, version = 'v1')
+        assert unchanged == 1
+        assert groups['web'] == [('web0', 'web'), ('web2', 'web')]
+
+    def test_bootstrap_state(self):
+        org, web, db_grp = self.add_org()
+        assert len(pending_bootstrap(org)) == 4
+        # the bootstrap script is missing here, so the bootstrap fails
+        status, output, error = bootstrap_node('web0', 'web', os.path.join(basedir, 'tmp', 'test-bootstrap.log.gz'))
+        assert status != 0
+        node = Node.query.filter_by(name = 'web0').first()
+        assert node.bootstrap_status == BOOTSTRAP_FAILED
+        assert node.bootstrap_job.exit_code == status
+        assert ('web0', 'web') in pending_bootstrap(org)
+        # a queued bootstrap is recorded on its node by the worker finishing it
+        job, created = start_job('bootstrap.bat 10.0.0.1 web', bootstrap_key('10.0.0.1', 'web'))
+        finish_job(job, 0, 'done', '')
+        node = Node.query.filter_by(name = 'web1').first()
+        assert node.bootstrap_status == BOOTSTRAP_DONE and node.bootstrap_job_id == job.id
+        Node.query.filter(Node.name.in_(['web0', 'web1'])).update({'bootstrap_status': BOOTSTRAP_DONE}, synchronize_session = False)
+        db.session.commit()
+        assert pending_bootstrap(org) == [('web2', 'web'), ('db0', 'db')]
+        assert pending_bootstrap(org, grp = db_grp) == [('db0', 'db')]
+
+    def test_cron_schedule(self):
+        after = datetime(2013, 1, 31, 23, 59, 30)
+        assert CronSchedule('*/15 * * * *').next_after(after) == datetime(2013, 2, 1, 0, 0)
+        assert CronSchedule('30 2 * * 1-5').next_after(after) == datetime(2013, 2, 1, 2, 30)
+        assert CronSchedule('0 3 * * 7').next_after(after) == datetime(2013, 2, 3, 3, 0)
+        assert CronSchedule('0 0 29 2 *').next_after(after) == datetime(2016, 2, 29, 0, 0)
+        for expression in ['61 * * * *', '* * * *', '*/0 * * * *']:
+            self.assertRaises(ValueError, CronSchedule, expression)
+        self.assertRaises(ValueError, CronSchedule('0 0 30 2 *').next_after, after)
+
+    def test_schedule_catch_up(self):
+        org, web, db_grp = self.add_org()
+        now = datetime(2013, 6, 1, 2, 0, 10)
+        due = DeploySchedule(org = org, env = web.env, grp = web, cron = '0 2 * * *', run_at = datetime(2013, 6, 1, 2, 0), enabled = True)
+        missed = DeploySchedule(org = org, env = web.env, grp = db_grp, cron = '0 2 * * *', run_at = datetime(2013, 5, 30, 2, 0), enabled = True, catch_up = CATCH_UP_SKIP)
+        caught = DeploySchedule(org = org, env = web.env, cron = '0 * * * *', run_at = datetime(2013, 5, 30, 2, 0), enabled = True, catch_up = CATCH_UP_ONCE)
+        once = DeploySchedule(org = org, env = web.env, run_at = datetime(2013, 6, 1, 1, 59), enabled = True)
+        later = DeploySchedule(org = org, env = web.env, run_at = datetime(2013, 6, 1, 3, 0), enabled = True)
+        db.session.add_all([due, missed, caught, once, later])
+        db.session.commit()
+        ids = [schedule.id for schedule in (due, missed, caught, once, later)]
+        assert sorted(claim_due(now)) == sorted([ids[0], ids[2], ids[3]])
+        assert claim_due(now) == []
+        due, missed, caught, once, later = [DeploySchedule.query.get(id) for id in ids]
+        assert due.run_at == datetime(2013, 6, 2, 2, 0)
+        assert missed.run_at == datetime(2013, 6, 2, 2, 0)
+        assert caught.run_at == datetime(2013, 6, 1, 3, 0)
+        assert not once.enabled
+        assert later.enabled and later.run_at == datetime(2013, 6, 1, 3, 0)
+
+    def test_deploy_plan(self):
+        org, web, db_grp = self.add_org()
+        assert batch_estimate([10, 20, 30], 2) == 40
+        assert batch_estimate([10, None], 2) is None
+        assert deploy_plan(org)['estimate'] is None
+        for name, duration in (('web0', 10), ('web1', 20), ('db0', 30)):
+            node = Node.query.filter_by(name = name).first()
+            db.session.add(NodeDeployResult(node = node, exit_status = 0, duration = duration, started_at = datetime.utcnow()))
+        db.session.add(NodeDeployResult(node = node, exit_status = 1, duration = 500, started_at = datetime.utcnow()))
+        # deploys older than PLAN_HISTORY days are not part of the estimates
+        web2 = Node.query.filter_by(name = 'web2').first()
+        db.session.add(NodeDeployResult(node = web2, exit_status = 0, duration = 500, started_at = datetime.utcnow() - timedelta(days = 365)))
+        db.session.commit()
+        plan = deploy_plan(org, strategy = make_strategy('rolling', 2), order = 'db > web')
+        assert plan['nodes'] == 4
+        assert [[group['name'] for group in stage['groups']] for stage in plan['stages']] == [['db'], ['web']]
+        web_plan = plan['stages'][1]['groups'][0]
+        assert [batch['nodes'] for batch in web_plan['batches']] == [['web0', 'web1'], ['web2']]
+        # web2 was never deployed and is estimated with the mean of the others
+        assert [batch['estimate'] for batch in web_plan['batches']] == [20, 20]
+        assert plan['estimate'] == 70
+        assert deploy_plan(org, grp = web)['estimate'] == 20
+        # the probe triage of the rollout applies to the plan: unreachable nodes go last
+        save_probes([ProbeResult('web0', False, None, 'port 22: timed out')])
+        db.session.commit()
+        plan = deploy_plan(org, grp = web)
+        assert plan['stages'][0]['groups'][0]['batches'][0]['nodes'] == ['web1', 'web2', 'web0']
+        assert plan['left_out'] == []
+
+    def test_coalescing(self):
+        j1, created = insert_job(Job(command = 'deploy.bat web0 web', status = JOB_QUEUED, inflight_key = 'deploy:web0:web'))
+        assert created
+        j2, created = insert_job(Job(command = 'deploy.bat web0 web', status = JOB_QUEUED, inflight_key = 'deploy:web0:web'))
+        assert not created
+        assert j2.id == j1.id
+        j3, created = start_job('deploy.bat web1 web', 'deploy:web1:web')
+        assert created and j3.id != j1.id
+        finish_job(j1, 0, 'done', '')
+        j4, created = start_job('deploy.bat web0 web', 'deploy:web0:web')
+        assert created and j4.id != j1.id
+        org, web, db_grp = self.add_org()
+        r1, created = start_run(org = org, grp = web, key = 'update:grp:1')
+        assert created
+        r2, created = start_run(org = org, grp = web, key = 'update:grp:1')
+        assert not created and r2.id == r1.id
+        finish_run(r1, [])
+        r3, created = start_run(org = org, grp = web, key = 'update:grp:1')
+        assert created and r3.id != r1.id
+
+    def test_deploy_slots(self):
+        j1, created = start_job('deploy.bat web0 web', 'deploy:web0:web', grp_name = 'web')
+        j2, created = start_job('deploy.bat web1 web', 'deploy:web1:web', grp_name = 'web')
+        s1 = acquire('grp:web', 2, j1.id)
+        s2 = acquire('grp:web', 2, j2.id)
+        depth = queue_depth()
+        assert depth['running'] == {'grp:web': 2}
+        assert depth['waiting'] == {}
+        release([s1])
+        assert queue_depth()['running'] == {'grp:web': 1}
+        finish_job(j2, 0, '', '')
+        release_stale()
+        assert queue_depth()['running'] == {}
+
+    def test_command_timeout_kills_tree(self):
+        command = Command(['sh', '-c', 'sleep 60 & sleep 60; echo never'])
+        started = time.time()
+        status, output, error = command.run(timeout = 1)
+        assert time.time() - started < 5
+        assert status != 0
+        assert 'never' not in output
+        assert command.usage.wall_time >= 1
+        command = Command(['sh', '-c', 'echo usage'])
+        command.run()
+        assert command.usage.cpu_time is not None
+        assert command.usage.max_rss > 0
+
     def test_translation(self):
         assert microsoft_translate(u'English', 'en', 'es') == u'Inglés'
         assert microsoft_translate(u'Español', 'es', 'en') == u'Spanish'